@@ -139,7 +139,7 @@ class DSF_loader:
         print("XP Path: {}".format(self.xp_path))
 
         dsf = XPLNEDSF()
-        dsf.read(dsf_filename)  # read the filename in delivered with os-specific separator
+        dsf.read(dsf_filename, lazy=True, extract=("patches",), rasters=("elevation",))  # read the filename in delivered with os-specific separator; only terrain and elevation are extracted, raster is not decoded, only window of area below
 
         print("------------ Starting to transform DSF ------------------")
         grid_west = int(dsf.Properties["sim/west"])
@@ -176,6 +176,47 @@ class DSF_loader:
             else:
                 ter_layers[ter_type] = [p]
         print("Sorted {} mesh patches into {} different types".format(len(dsf.Patches), len(ter_layers)))        
+
+        # Select triangles in area and get elevations just for their vertices from the raster window covering them
+        area_trias = dict()  # triangles of each patch with at least one vertex in area
+        for p in dsf.Patches:
+            area_trias[p] = []
+        used_vertices = dict()  # indices of vertices per pool used by these triangles
+        grid = dsf.getTriangleGrid()  # only triangles in grid cells of the area are tested; None without numpy
+        if grid is not None:
+            candidates = grid.query(self.AREA_W, self.AREA_E, self.AREA_S, self.AREA_N)
+            lon = grid.lon[candidates]
+            lat = grid.lat[candidates]
+            inside = ((self.AREA_W <= lon) & (lon <= self.AREA_E) & (self.AREA_S <= lat) & (lat <= self.AREA_N)).any(axis=1)
+            for i in candidates[inside]:  # sorted, so triangles keep their order within patch
+                t = [[int(grid.table.pools[i][j]), int(grid.table.vertices[i][j])] for j in range(3)]
+                area_trias[dsf.Patches[grid.table.patch[i]]].append(t)
+                for v in t:
+                    used_vertices.setdefault(v[0], set()).add(v[1])
+            print("Selected {} of {} triangles in area".format(int(inside.sum()), len(grid.table)))
+        else:  # every triangle of the tile is tested
+            for p in dsf.Patches:
+                for t in p.triangles():
+                    if not (self.AREA_W <= dsf.V[t[0][0]][t[0][1]][0] <= self.AREA_E and self.AREA_S <= dsf.V[t[0][0]][t[0][1]][1] <= self.AREA_N)  \
+                        and not (self.AREA_W <= dsf.V[t[1][0]][t[1][1]][0] <= self.AREA_E and self.AREA_S <= dsf.V[t[1][0]][t[1][1]][1] <= self.AREA_N) \
+                        and not (self.AREA_W <= dsf.V[t[2][0]][t[2][1]][0] <= self.AREA_E and self.AREA_S <= dsf.V[t[2][0]][t[2][1]][1] <= self.AREA_N):
+                            continue
+                    area_trias[p].append(t)
+                    for v in t:
+                        used_vertices.setdefault(v[0], set()).add(v[1])
+        elevations = dict()  # elevation per pool and vertex index, resolved at once for all used vertices
+        if used_vertices:
+            lons = [dsf.V[pool][i][0] for pool in used_vertices for i in used_vertices[pool]]
+            lats = [dsf.V[pool][i][1] for pool in used_vertices for i in used_vertices[pool]]
+            window = dsf.getRasterWindow(min(lons), max(lons), min(lats), max(lats))  # triangles can reach out of area
+            if window is not None:
+                print("Decoded {} x {} pixels of raster for elevations".format(len(window.data), len(window.data[0]) if len(window.data) else 0))
+            for pool in used_vertices:
+                indices = sorted(used_vertices[pool])
+                values = [dsf.V[pool][i][2] for i in indices]  # without raster the elevations of the vertices are used
+                if window is not None:
+                    values = dsf.getVertexElevations([dsf.V[pool][i][0] for i in indices], [dsf.V[pool][i][1] for i in indices], values, raster=window)
+                elevations[pool] = dict(zip(indices, values))
             
         verts = []
         edges = []  # will not be filled as Blender takes in case of empty edges the edges from the faces
@@ -198,7 +239,7 @@ class DSF_loader:
                 else: 
                     layer += 1  # this requires that there was base-mesh before settin layer=0
             for p in ter_layers[ter_layer_id]:
-                trias = p.triangles()
+                trias = area_trias[p]
                 
                 if water and len(trias) and len(dsf.V[trias[0][0][0]][trias[0][0][1]]) <= 5:
                     projected_uv = True
@@ -209,10 +250,6 @@ class DSF_loader:
                 # if water is projected depends if uv coordinates are given or not, taken from ferst vertex in first tria
 
                 for t in trias:
-                    if not (self.AREA_W <= dsf.V[t[0][0]][t[0][1]][0] <= self.AREA_E and self.AREA_S <= dsf.V[t[0][0]][t[0][1]][1] <= self.AREA_N)  \
-                        and not (self.AREA_W <= dsf.V[t[1][0]][t[1][1]][0] <= self.AREA_E and self.AREA_S <= dsf.V[t[1][0]][t[1][1]][1] <= self.AREA_N) \
-                        and not (self.AREA_W <= dsf.V[t[2][0]][t[2][1]][0] <= self.AREA_E and self.AREA_S <= dsf.V[t[2][0]][t[2][1]][1] <= self.AREA_N):
-                            continue
                     ti = []  # index list of vertices of tria that will be added to faces
                     tuvs = []  # uvs for that triangle
                     tuvs2 = []  # 2nd uves for triangle e.g. for borders if existent
@@ -220,7 +257,7 @@ class DSF_loader:
                         #### TBD: Scale to Marcartor in order to have same east/west and north/south dimension #####
                         vx = round((dsf.V[v[0]][v[1]][0] - grid_west) * self.SCALING, 3)
                         vy = round((dsf.V[v[0]][v[1]][1] - grid_south) * self.SCALING, 3)
-                        vz = dsf.getVertexElevation(dsf.V[v[0]][v[1]][0], dsf.V[v[0]][v[1]][1], dsf.V[v[0]][v[1]][2])
+                        vz = elevations[v[0]][v[1]]
                         vz = round(vz / (100000/self.SCALING), 3)  ### TBD: Make stretching of height configureable
                         if (vx, vy) in coords:
                             vi = coords[(vx, vy)]
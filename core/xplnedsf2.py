@@ -30,13 +30,72 @@
 ###            Checking out of bound when packing raster values (might be removed again!)
 ### NEW 0.5.7: Returning error coder for getDSFproperties()
 ### NEW 0.5.9: Allowing empty DEFN sub atoms, especially for DEMN supporting dsf files for X-Plane 10
+### NEW 0.6.0: read(file, usemmap=True) memory-maps the dsf file and keeps only memoryview slices in _Atoms_
+###            read(file, lazy=True) decodes raster, pools and commands only when first accessed
+###            scanDSFatoms() and getDSFatomTOC() build table of contents only by reading atom headers
+###            DSF7zArchive extracts 7z compressed dsf files with python lzma module (py7zlib only used as fallback)
+###            DSFcache stores decompressed dsf files of 7z archives in directory with least recently used eviction
+###            read() also from bytes, memoryview, opened binary files and members of zip or 7z archives
+###            read(file, verify=True) checks md5 hash in footer while reading and stops before unpacking corrupt files
+###            XPLNEDSF instances can be used in parallel threads: no re-init in read(), default logger only configured once
+###            read(file, parallel=n) unpacks raster layers, pools and commands in n processes sharing atoms and results in shared memory
+###            readDSFbatch() reads several dsf files in a process pool and yields them as they are read, limited by estimated memory
+###            pools are decoded vectorized with numpy, if installed
+###            with numpy pools are stored as XPLNEpool in 2-dimensional arrays, still indexed by V[pool][vertex][plane]
+###            read(file, deferscaling=True, floattype='float32') scales pools with first access, as float32 if set; empty pools or planes with scale 0 no longer stop scaling of the following ones
+###            with numpy pools are encoded vectorized, each plane with the encoding (0 to 3) that needs least bytes
+###            write(file, optimize='morton' or 'firstuse') reorders vertices in pools spatially or by first use in commands and adapts references
+###            with numpy raster layers are decoded at once and stored as 2-dimensional array, still indexed by data[x][y]
+###            with numpy raster layers are encoded at once; values out of range are clipped for all integer types and reported in one log entry
+###            getVertexElevations(x, y, z, mode) returns elevations for many points at once, by nearest pixel or bilinear interpolation
+###            getRasterWindow() decodes only the pixels of a raster layer covering a lon/lat window, to be used with getVertexElevations()
+###            XPLNEraster.pyramid() builds downsampled levels by mean, min or max; getRasterLevel() returns a level and stores levels in DSFcache (requires numpy)
+###            commands are decoded in one pass with precompiled structs and extracted directly; CMDS only filled with read(file, keepcmds=True)
+###            getTriangleTable() returns all triangles of all patches as XPLNEtriangles in numpy arrays, XPLNEpatch.triangleArrays() for one patch
+###            getTriangleGrid() returns XPLNEtriangleGrid, a uniform grid over the tile to query triangles intersecting a lon/lat rectangle
+###            iterCommands() and iterTriangles(batchsize) stream commands or batches of triangles directly from the commands atom
+###            read(file, extract=('patches',), rasters=('elevation',)) extracts only selected content; other commands are skipped while decoding
 
 from os import path, stat #required to retrieve length of dsf-file
-from struct import pack, unpack #required for binary pack and unpack
-from hashlib import md5 #required for md5 hash in dsf file footer
+from os import makedirs, listdir, remove, replace, utime, close #required for cache of decompressed dsf-files
+from struct import pack, unpack, Struct #required for binary pack and unpack
+from hashlib import md5, sha1 #required for md5 hash in dsf file footer and keys of cached files
 from logging import StreamHandler, getLogger, Formatter #for output to console and/or file
-from io import BytesIO #required to go through bytes of a read 7ZIP-File
+from io import BytesIO, RawIOBase, UnsupportedOperation #required to go through bytes of a read 7ZIP-File and dsf data in memory
+from contextlib import contextmanager #required to open different sources of dsf data in the same way
+from zipfile import ZipFile, BadZipFile #required to read dsf files from zip archives
+from shutil import copyfileobj #required to extract dsf files from zip archives in chunks
+from mmap import mmap, ACCESS_READ #required for zero-copy reading of dsf files mapped to memory
 from math import sin, cos, sqrt, atan2, radians # for distance calculation etc.
+from tempfile import TemporaryFile, mkstemp #required to store decompressed data of 7ZIP-File
+from zlib import crc32 #required for checking crc values in 7ZIP-Files
+from threading import Lock, RLock #required to use instances and default logger from several threads
+from copy import copy #required to get raster windows on a copy of the raster
+from itertools import chain #required to flatten pools when unpacked in parallel processes
+from array import array #required to copy pools and raster data to shared memory
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED #required to read dsf files or unpack atoms in parallel processes
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError: #shared memory requires python 3.8
+    SHAREDMEMORY = False
+else:
+    SHAREDMEMORY = True
+
+try:
+    import lzma
+except ImportError:
+    LZMAINSTALLED = False
+else:
+    LZMAINSTALLED = True
+
+try:
+    import numpy as np
+except ImportError:
+    NUMPYINSTALLED = False
+else:
+    NUMPYINSTALLED = True
 
 try:
     import py7zlib
@@ -45,6 +104,10 @@ except ImportError:
 else:
     PY7ZLIBINSTALLED = True
 
+_DSFATOMSOFATOMS = ('DAEH', 'NFED', 'DOEG', 'SMED') #atoms that just contain further atoms; used when scanning atoms outside of XPLNEDSF
+_LOGGERLOCK = Lock() #makes sure default logger gets just one handler, even when instances are created in parallel threads
+_WORKERDSF = None #instance of XPLNEDSF used in worker process to unpack atoms in parallel
+_DSFMEMORYFACTOR = 25 #memory of XPLNEDSF instance compared to size of the dsf file read, used to estimate memory in readDSFbatch()
 
 
 class XPLNEpatch:
@@ -99,6 +162,43 @@ class XPLNEpatch:
                     l.append( [ [p, c[1]], [p, v + 1], [p, v + 2] ] )                    
         return l
               
+    def triangleArrays(self): #returns triangles as two numpy arrays (N, 3) with pool and vertex index of each vertex, expanded vectorized from the commands in same order as triangles()
+        pools = []
+        vertices = []
+        p = None #current pool needs to be defined with first command
+        for c in self.cmds:
+            if c[0] == 1: # Pool index changed within patch, so change
+                p = c[1]
+                continue
+            if c[0] in (23, 25, 26, 28, 29, 31): #commands with indices in current pool
+                if c[0] == 23: # PATCH TRIANGLE
+                    t = np.array(c[1 : 1 + (len(c) - 1) // 3 * 3], np.int64).reshape(-1, 3)
+                elif c[0] == 25: # PATCH TRIANGLE RANGE
+                    t = np.arange(c[1], c[2] - 1, 3)[:, None] + np.arange(3) #last index has one added
+                elif c[0] in (26, 28): # PATCH TRIANGLE STRIP, without or with range
+                    s = np.array(c[1:], np.int64) if c[0] == 26 else np.arange(c[1], c[2])
+                    t = np.stack((s[:-2], s[1:-1], s[2:]), axis=1) if len(s) > 2 else np.empty((0, 3), np.int64)
+                    t[1::2, 1:] = t[1::2, :0:-1] #Strip 1,2,3,4,5 refers to triangles 1,2,3 2,4,3 3,4,5
+                else: # PATCH TRIANGLE FAN, without or with range; at c[1] is the center point id of the fan
+                    s = np.array(c[2:], np.int64) if c[0] == 29 else np.arange(c[1] + 1, c[2])
+                    t = np.stack((np.full(max(len(s) - 1, 0), c[1]), s[:-1], s[1:]), axis=1) if len(s) > 1 else np.empty((0, 3), np.int64)
+                pools.append(np.full(t.shape, p))
+                vertices.append(t)
+            elif c[0] in (24, 27, 30): #cross pool commands with pairs of pool and index
+                s = np.array(c[1 : 1 + (len(c) - 1) // 2 * 2], np.int64).reshape(-1, 2)
+                if c[0] == 24: # PATCH TRIANGLE CROSS POOL
+                    s = s[: len(s) // 3 * 3].reshape(-1, 3, 2)
+                elif c[0] == 27: # PATCH TRIANGLE STRIP CROSS POOL
+                    s = np.stack((s[:-2], s[1:-1], s[2:]), axis=1) if len(s) > 2 else np.empty((0, 3, 2), np.int64)
+                    s[1::2, 1:] = s[1::2, :0:-1]
+                else: # PATCH TRIANGLE FAN CROSS POOL, with pool index and point id of fan center first
+                    s = np.stack((np.broadcast_to(s[0], s[2:].shape), s[1:-1], s[2:]), axis=1) if len(s) > 2 else np.empty((0, 3, 2), np.int64)
+                pools.append(s[:, :, 0])
+                vertices.append(s[:, :, 1])
+        if not pools:
+            return np.empty((0, 3), np.int64), np.empty((0, 3), np.int64)
+        return np.concatenate(pools).astype(np.int64), np.concatenate(vertices).astype(np.int64)
+
     def trias2cmds(self, trias): ############## UPDATE FOR MEXP to allow definition of own trias 
         ### For the moment only uses single tirangle CMDS for different pools ## To be updeated
         if len(self.cmds) > 0: ############### NEW 03.04.2020 ####################################
@@ -130,23 +230,267 @@ class XPLNEraster: #Stores data of Raster Atoms (each dsf could have serverl ras
         self.height = None #of area in pixel
         self.scale = None #scale factor for height values
         self.offset = None #offset for heigt values
-        self.data = [] #will store final raster heigt values (after scaling and adding offset) in 2-dimensional list: [pixel x] [pixel y]
+        self.data = [] #will store final raster heigt values (after scaling and adding offset) in 2-dimensional list: [pixel x] [pixel y]; with numpy 2-dimensional array indexed the same way
+        self.x0 = 0 #first pixel in x of data, in case data covers only a window of the raster (see XPLNEDSF.getRasterWindow())
+        self.y0 = 0 #first pixel in y of data
+        self._pyramid_ = {} #downsampled levels of data for each method, built with first call of pyramid()
+    def _downsample_(self, data, method): #returns data with half the pixels in x and y, each block of 2 x 2 pixels replaced by its mean, min or max; last pixel of odd lines is repeated
+        if NUMPYINSTALLED:
+            data = np.asarray(data, np.float64)
+            width, height = data.shape
+            blocks = np.pad(data, ((0, width % 2), (0, height % 2)), mode='edge').reshape((width + 1) // 2, 2, (height + 1) // 2, 2)
+            return getattr(blocks, method)(axis=(1, 3))
+        f = {'mean' : lambda l: sum(l) / 4, 'min' : min, 'max' : max}[method]
+        width, height = len(data), len(data[0])
+        return [[f([data[x][y], data[min(x + 1, width - 1)][y], data[x][min(y + 1, height - 1)], data[min(x + 1, width - 1)][min(y + 1, height - 1)]]) for y in range(0, height, 2)] for x in range(0, width, 2)]
+    def pyramid(self, method = 'mean'): #returns list of levels with data downsampled by 2 from level to level using mean, min or max per block; level 0 is data itself; levels are kept for later calls
+        if method not in ('mean', 'min', 'max'):
+            return None
+        if method not in self._pyramid_:
+            levels = [self.data]
+            while len(levels[-1]) and (len(levels[-1]) > 1 or len(levels[-1][0]) > 1):
+                levels.append(self._downsample_(levels[-1], method))
+            self._pyramid_[method] = levels
+        return self._pyramid_[method]
+    def level(self, resolution): #returns highest level of pyramid that has still at least resolution pixels in x and y
+        level = 0
+        width, height = self.width, self.height
+        while (width + 1) // 2 >= resolution and (height + 1) // 2 >= resolution and (width > 1 or height > 1):
+            width, height = (width + 1) // 2, (height + 1) // 2
+            level += 1
+        return level
         
 
+class XPLNEpool: #Stores vertices of a pool in numpy array [vertex, plane]; can be indexed and appended like the list of vertices used without numpy
+    def __init__(self, array):
+        self._array_ = array #numpy array with one row per vertex and one column per plane; None as long as scaling is deferred
+        self._raw_ = None #values as stored in dsf file, kept when scaling is deferred
+        self._scalings_ = None #multiplier and offset for each plane used for deferred scaling
+        self._maxint_ = None #maximum integer value for deferred scaling
+        self._dtype_ = None #float type of values after deferred scaling
+        self._appended_ = [] #vertices appended, but not yet added to array
+    def _merge_(self): #adds appended vertices to array
+        if len(self._array_):
+            self._array_ = np.concatenate((self._array_, np.array(self._appended_, self._array_.dtype if self._array_.dtype.kind == 'f' else np.float64)))
+        else:
+            self._array_ = np.array(self._appended_, np.float64)
+        self._appended_ = []
+    def _scaleRaw_(self): #computes array from raw values with deferred scaling
+        self._array_ = self._raw_.astype(self._dtype_)
+        for n, (m, o) in enumerate(self._scalings_):
+            if float(m) != 0.0: #planes with scale 0 are not scaled
+                self._array_[:, n] = (self._raw_[:, n] * m / self._maxint_) + o #computed in float64 and only then stored in dtype of array
+        self._raw_ = None
+    def _scale_(self, scalings, maxint, dtype = 'float64', defer = False): #scales values of pool as read from file, if defer only with first access
+        self._raw_ = self.array
+        self._array_ = None
+        self._scalings_ = [list(s) for s in scalings]
+        self._maxint_ = maxint
+        self._dtype_ = np.dtype(dtype)
+        if not defer:
+            self._scaleRaw_()
+    def _descale_(self, scalings, maxint): #sets values back to integers as stored in file; if scaling is still deferred nothing has to be done
+        if self._array_ is None and not self._appended_ and self._scalings_ == scalings and self._maxint_ == maxint:
+            return
+        a = self.array
+        raw = np.empty(a.shape, np.int64)
+        for n, (m, o) in enumerate(scalings):
+            if float(m) != 0.0:
+                raw[:, n] = np.round((a[:, n].astype(np.float64) - o) * maxint / m)
+            else:
+                raw[:, n] = np.round(a[:, n])
+        self._raw_ = raw #pool keeps its scaled values by deferred scaling of these integers
+        self._array_ = None
+        self._scalings_ = [list(s) for s in scalings]
+        self._maxint_ = maxint
+        self._dtype_ = a.dtype if a.dtype.kind == 'f' else np.dtype(np.float64)
+    @property
+    def array(self): #the array of the pool with scaled values for vectorized access
+        if self._array_ is None:
+            self._scaleRaw_()
+        if self._appended_:
+            self._merge_()
+        return self._array_
+    @array.setter
+    def array(self, array):
+        self._array_ = array
+        self._raw_ = None
+        self._appended_ = []
+    @property
+    def raw(self): #values as stored in file, as long as scaling is deferred, otherwise None
+        return self._raw_
+    @property
+    def shape(self): #number of vertices and planes without scaling deferred values
+        a = self._raw_ if self._array_ is None else self._array_
+        if self._appended_:
+            return len(a) + len(self._appended_), len(self._appended_[0])
+        return a.shape
+    def __len__(self):
+        return len(self._raw_ if self._array_ is None else self._array_) + len(self._appended_)
+    def __getitem__(self, i): #returns vertex i as view on the array, so that values can also be changed by V[pool][vertex][plane] = value
+        if self._array_ is None or self._appended_:
+            return self.array[i]
+        return self._array_[i]
+    def __setitem__(self, i, vertex):
+        self.array[i] = vertex
+    def __iter__(self):
+        return iter(self.array)
+    def __eq__(self, other):
+        if isinstance(other, XPLNEpool):
+            other = other.tolist()
+        return len(self) == len(other) and self.tolist() == other
+    def _reorder_(self, order): #puts vertices in new order, where order[i] is the old index of vertex i; deferred scaling is kept
+        if self._array_ is None:
+            self._raw_ = self._raw_[order]
+        else:
+            self._array_ = self.array[order]
+    def append(self, vertex):
+        self._appended_.append(vertex)
+    def tolist(self): #returns pool as list of vertices with list of values for each plane
+        return self.array.tolist()
+
+
+class XPLNEtriangles: #Table of all triangles of the terrain patches in numpy arrays with one row per triangle (see XPLNEDSF.getTriangleTable())
+    def __init__(self):
+        self.pools = None #array (N, 3) with pool index of each vertex of the triangles
+        self.vertices = None #array (N, 3) with index of each vertex in its pool
+        self.patch = None #index of patch in Patches for each triangle
+        self.defIndex = None #terrain definition of patch for each triangle
+        self.flag = None #1 if physical, 2 if overlay for each triangle
+        self.near = None #near LOD of patch for each triangle
+        self.far = None #far LOD of patch for each triangle
+    def __len__(self):
+        return len(self.patch)
+
+
+class XPLNEtriangleGrid: #Uniform grid over the tile with the triangles whose bounding box overlaps each cell, so triangles in an area are found in time proportional to the result (see XPLNEDSF.getTriangleGrid())
+    def __init__(self, table, lon, lat, west, east, south, north, cells = 64):
+        self.table = table #XPLNEtriangles with all triangles indexed
+        self.lon = lon #array (N, 3) with longitude of each vertex of the triangles
+        self.lat = lat #array (N, 3) with latitude of each vertex of the triangles
+        self.box = np.stack((lon.min(axis=1), lon.max(axis=1), lat.min(axis=1), lat.max(axis=1)), axis=1) if len(lon) else np.empty((0, 4)) #west, east, south, north of each triangle
+        self.west = west
+        self.south = south
+        self.cells = cells #number of cells in x and y
+        self.cellwidth = (east - west) / cells
+        self.cellheight = (north - south) / cells
+        x0, x1 = self._cellRange_(self.box[:, 0], self.box[:, 1], west, self.cellwidth)
+        y0, y1 = self._cellRange_(self.box[:, 2], self.box[:, 3], south, self.cellheight)
+        counts = (x1 - x0 + 1) * (y1 - y0 + 1) #number of cells for each triangle
+        n = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) #number of cell within cells of its triangle
+        width = np.repeat(x1 - x0 + 1, counts)
+        cell = (np.repeat(y0, counts) + n // width) * cells + np.repeat(x0, counts) + n % width
+        order = np.argsort(cell, kind='stable')
+        self._triangles_ = np.repeat(np.arange(len(counts)), counts)[order] #triangles sorted by cell, for cell c from _offsets_[c] to _offsets_[c + 1]
+        self._offsets_ = np.concatenate(([0], np.cumsum(np.bincount(cell, minlength=cells * cells))))
+    def _cellRange_(self, lower, upper, start, size): #returns first and last cell covering values from lower to upper; values outside the tile are in the border cells
+        first = np.clip(np.floor((np.asarray(lower) - start) / size), 0, self.cells - 1).astype(np.int64)
+        last = np.clip(np.floor((np.asarray(upper) - start) / size), 0, self.cells - 1).astype(np.int64)
+        return first, last
+    def query(self, west, east, south, north): #returns sorted indices in table of triangles with bounding box intersecting the rectangle
+        if west > east or south > north:
+            return np.empty(0, np.int64)
+        x0, x1 = self._cellRange_(west, east, self.west, self.cellwidth)
+        y0, y1 = self._cellRange_(south, north, self.south, self.cellheight)
+        parts = [self._triangles_[self._offsets_[y * self.cells + x0] : self._offsets_[y * self.cells + x1 + 1]] for y in range(y0, y1 + 1)] #cells of a row follow each other
+        candidates = np.unique(np.concatenate(parts)) if parts else np.empty(0, np.int64)
+        box = self.box[candidates]
+        return candidates[(box[:, 0] <= east) & (box[:, 1] >= west) & (box[:, 2] <= north) & (box[:, 3] >= south)]
+
+
+class _LazyStage_: #descriptor for attributes of XPLNEDSF that are decoded from atoms with first access when read in lazy mode
+    def __init__(self, stage):
+        self.stage = stage #name of stage in XPLNEDSF._StageAttributes_ that creates this attribute
+    def __set_name__(self, owner, name):
+        self.name = name
+    def __get__(self, instance, owner): #only called as long as attribute is not in instance dict, so no overhead after decoding
+        if instance is None:
+            return self
+        instance._unpackStage_(self.stage)
+        return instance.__dict__[self.name]
+
+
 class XPLNEDSF:   
-    def __init__(self, logname='__XPLNEDSF__', statusfunction = "stdout"):
-        if logname != "_keep_logger_": self._log_ = self._setLogger_(logname)
-        if statusfunction != "_keep_statusfunction_": self._statusfunction_ = statusfunction
-        self._DEBUG_ = True if self._log_.getEffectiveLevel() < 20 else False #have DEBUG value in order to call only logger for debug if DEBUG enabled  --> saves time
-        self._progress_ = [0, 0, 0] #progress as 3 list items (amount of bytes read/written in percant and shown, read/written but not yet shown as number of bytes) and number of bytes to be processed in total
-        self._Atoms_ = {} #dictonary containg for every atom in file the according strings
+    _StageAttributes_ = {'raster' : ['Raster'], 'pools16' : ['V', 'Scalings'], 'pools32' : ['V32', 'Scal32'], 'cmds' : ['CMDS', 'Patches', 'Polygons', 'Objects', 'Networks']} #attributes created by each stage of unpacking atoms
+    _CMDStructs_ = {} #Struct objects for fixed values and number of repetitions plus size of repeated values for each command id, Struct for each command id with number of repetitions
+    _ContentCMDS_ = {'objects' : (7, 8), 'networks' : (9, 10, 11), 'polygons' : (12, 13, 14, 15), 'patches' : (16, 17, 18, 23, 24, 25, 26, 27, 28, 29, 30, 31)} #command ids for content classes that can be selected in read()
+    _StageAtoms_ = {'raster' : ['IMED', 'DMED'], 'pools16' : ['LOOP', 'LACS'], 'pools32' : ['23OP', '23CS'], 'cmds' : ['SDMC']} #atoms unpacked by each stage
+    Raster = _LazyStage_('raster')
+    V = _LazyStage_('pools16')
+    Scalings = _LazyStage_('pools16')
+    V32 = _LazyStage_('pools32')
+    Scal32 = _LazyStage_('pools32')
+    CMDS = _LazyStage_('cmds')
+    Patches = _LazyStage_('cmds')
+    Polygons = _LazyStage_('cmds')
+    Objects = _LazyStage_('cmds')
+    Networks = _LazyStage_('cmds')
+
+    def __init__(self, logname='__XPLNEDSF__', statusfunction = "stdout"): #statusfunction None for no progress output when reading/writing in parallel threads
+        self._log_ = self._setLogger_(logname)
+        self._logname_ = logname #required to set up logger in worker processes
+        self._statusfunction_ = statusfunction
+        self._lock_ = RLock() #guards unpacking of atoms in lazy mode, when instance is accessed from several threads
         self._AtomStructure_ = {'DAEH' : ['PORP'], 'NFED' : ['TRET', 'TJBO', 'YLOP', 'WTEN', 'NMED'], 'DOEG' : ['LOOP', 'LACS', '23OP', '23CS'], 'SMED' : ['IMED', 'DMED'], 'SDMC' : []}
         self._AtomList_ = ['DAEH', 'NFED', 'DOEG', 'SMED', 'SDMC', 'PORP', 'TRET', 'TJBO', 'YLOP', 'WTEN', 'NMED', 'LOOP', 'LACS', '23OP', '23CS', 'IMED', 'DMED']
         self._AtomOfAtoms_ = ['DAEH', 'NFED', 'DOEG', 'SMED']
+        self._RasterTypes_ = {(1, 1) : '<b', (1, 2) : '<h', (1, 4) : '<i', (2, 1) : '<B', (2, 2) : '<H', (2, 4) : '<I', (0, 4) : '<f'} #type of raster values for first two bits of flags (signed or unsigned integers, otherwise float) and bytes per pixel
+        self._RasterLimits_ = {'<b' : (-128, 127), '<h' : (-32768, 32767), '<i' : (-2147483648, 2147483647), '<B' : (0, 255), '<H' : (0, 65535), '<I' : (0, 4294967295)} #range of values for integer raster types
         self._MultiAtoms_ = ['LOOP', 'LACS', '23OP', '23CS', 'IMED', 'DMED'] #These Atoms can occur severl times and therefore are stored as list in self._Atoms_
         self._CMDStructure_ = {1 : ['H'], 2 : ['L'], 3 : ['B'], 4 : ['H'], 5 : ['L'], 6 : ['B'], 7 : ['H'], 8 : ['HH'], 9 : ['', 'B', 'H'], 10 : ['HH'], 11 : ['', 'B', 'L'], 12 : ['H', 'B', 'H'], 13 : ['HHH'], 15 : ['H', 'B', 'H'], 16 : [''], 17 : ['B'], 18 : ['Bff'], 23 : ['', 'B', 'H'], 24 : ['', 'B', 'HH'], 25 : ['HH'], 26 : ['', 'B', 'H'], 27 : ['', 'B', 'HH'], 28 : ['HH'], 29 : ['', 'B', 'H'], 30 : ['', 'B', 'HH'], 31 : ['HH'], 32 : ['', 'B', 'c'], 33 : ['', 'H', 'c'], 34 : ['', 'L', 'c']}
         self._CMDStructLen_ = {1 : [2], 2 : [4], 3 : [1], 4 : [2], 5 : [4], 6 : [1], 7 : [2], 8 : [4], 9 : [0, 1, 2], 10 : [4], 11 : [0, 1, 4], 12 : [2, 1, 2], 13 : [6], 15 : [2, 1, 2], 16 : [0], 17 : [1], 18 : [9], 23 : [0, 1, 2], 24 : [0, 1, 4], 25 : [4], 26 : [0, 1, 2], 27 : [0, 1, 4], 28 : [4], 29 : [0, 1, 2], 30 :  [0, 1, 4], 31 : [4], 32 : [0, 1, 1], 33 : [0, 2, 1], 34 : [0, 4, 1]}
+        self._resetData_()
+        self._log_.info("Class XPLNEDSF initialized.")
+
+    def __getstate__(self): #for pickling, e.g. when instance is returned from worker process of readDSFbatch()
+        state = self.__dict__.copy()
+        del state['_lock_']
+        state['_mmap_'] = None
+        state['_Atoms_'] = self._detachedAtoms_()
+        return state
+
+    def _detachedAtoms_(self): #returns atoms as bytes that do not refer to memory map or shared memory
+        unpacked = [k for stage in self._StageAtoms_ if stage not in self._pendingStages_ for k in self._StageAtoms_[stage] if k != 'SDMC'] #commands are kept for iterCommands() and iterTriangles()
+        atoms = {}
+        for k, a in self._Atoms_.items(): #views on memory map or shared memory have to be copied, unpacked atoms are packed again before writing
+            if k in unpacked:
+                atoms[k] = [] if k in self._MultiAtoms_ else b''
+            elif isinstance(a, list):
+                atoms[k] = [bytes(x) for x in a]
+            else:
+                atoms[k] = bytes(a)
+        return atoms
+
+    def _releaseMap_(self): #closes memory map of file read with usemmap=True as soon as all stages are unpacked, so that file is no longer locked
+        if self._mmap_ is None or self._pendingStages_:
+            return
+        self._Atoms_ = self._detachedAtoms_()
+        try:
+            self._mmap_.close()
+        except BufferError: #views on map still in use elsewhere, map is then closed when they are released
+            self._log_.debug("Memory map still in use, it is closed when released.")
+        self._mmap_ = None
+        self._log_.info("All atoms unpacked, memory map of file closed.")
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock_ = RLock()
+
+    def _resetData_(self): #initializes all values of dsf data; called again for each read, so only the instance itself is changed
+        self._DEBUG_ = True if self._log_.getEffectiveLevel() < 20 else False #have DEBUG value in order to call only logger for debug if DEBUG enabled  --> saves time
+        self._progress_ = [0, 0, 0] #progress as 3 list items (amount of bytes read/written in percant and shown, read/written but not yet shown as number of bytes) and number of bytes to be processed in total
+        self._Atoms_ = {} #dictonary containg for every atom in file the according strings
+        self._mmap_ = None #memory map of dsf file if read with usemmap=True; atoms in _Atoms_ are then memoryview slices of it
+        self._pendingStages_ = set() #stages (see _StageAttributes_) with atoms read but not yet unpacked
+        self._deferScaling_ = False #True if pools (XPLNEpool) are only scaled with first access of values
+        self._floatType_ = 'float64' #type of scaled values in pools (XPLNEpool)
+        self._keepCMDS_ = False #True if all commands are also stored in CMDS
+        self._extract_ = None #content classes of _ContentCMDS_ selected for extraction, None for all
+        self._rasters_ = None #names of raster layers selected for decoding, None for all
+        self._cache_ = None #DSFcache used for reading, where also pyramids of raster layers are stored
+        self._cacheKey_ = None #key of file read in _cache_
         self.FileHash = "" #Hash value of dsf file read
+        self.FileHashValid = None #True or False if hash value was verified when reading file, None if not verified
         self.CMDS = [] #unpacked commands
         self.Patches = [] #mesh patches, list of objects of class XPLNEpatch
         self.V = [] # 3 dimensional list of all vertices whith V[PoolID][Vertex][xyz etc coordinates]
@@ -163,18 +507,18 @@ class XPLNEDSF:
         self.DefPolygons = {}  #dictionary containing for each index number (0 to n-1) the name of Polygon definition file
         self.DefNetworks = {}  #dictionary containing for each index number (0 to n-1) the name of Network definition file; actually just one file per dsf-file
         self.DefRasters = {}   #dictionary containing for each index number (0 to n-1) the name of Raster definition (for the moment assuing "elevaiton" is first with index 0)
-        self._log_.info("Class XPLNEDSF initialized.")
 
     def _setLogger_(self, logname):
         if logname == '__XPLNEDSF__': #define default logger if nothing is set
             logger = getLogger('XPLNEDSF')
-            logger.setLevel('INFO')
-            logger.handlers = []  # Spyder/IPython currently does not remove existing loggers, this does the job
-            stream_handler = StreamHandler()
-            stream_handler.setLevel('INFO')
-            formatter = Formatter('%(levelname)s: %(message)s')
-            stream_handler.setFormatter(formatter)
-            logger.addHandler(stream_handler)
+            with _LOGGERLOCK:
+                if not logger.handlers: #configure only once, so that existing instances (maybe in other threads) are not affected by new ones
+                    logger.setLevel('INFO')
+                    stream_handler = StreamHandler()
+                    stream_handler.setLevel('INFO')
+                    formatter = Formatter('%(levelname)s: %(message)s')
+                    stream_handler.setFormatter(formatter)
+                    logger.addHandler(stream_handler)
         else:
             logger = getLogger(logname + '.' + __name__) #use name of existing Logger in calling module to get logs in according format or change basicConfig for logs
         return logger
@@ -217,7 +561,7 @@ class XPLNEDSF:
             j = i
             while atom[j] != 0 and j < len(atom):
                 j += 1
-            l.append(atom[i:j].decode("utf-8"))
+            l.append(bytes(atom[i:j]).decode("utf-8")) #bytes() required in case atom is a memoryview
             i = j + 1
         return l
     
@@ -304,6 +648,14 @@ class XPLNEDSF:
         for s in atomstring: #goes through all Pools read; string s has to be unpacked
             nArrays, nPlanes = unpack('<IB', s[0:5])
             if self._DEBUG_: self._log_.debug("Pool number {} has {} Arrays (vertices) with {} Planes (coordinates per vertex)!".format(len(V), nArrays, nPlanes))
+            if NUMPYINSTALLED: #decode all planes vectorized
+                P = self._decodePoolNumpy_(s, nArrays, nPlanes, size)
+                if P is None:
+                    V.append([])
+                    return []
+                V.append(XPLNEpool(P))
+                self._updateProgress_(len(s))
+                continue
             V.append([]) #the current pool starts empty
             for i in range(nArrays): ## span up multi-dimensional array for the new pool of required size (number of vertices in pool)
                 V[-1].append([])
@@ -344,12 +696,112 @@ class XPLNEDSF:
             self._updateProgress_(len(s))
 
 
+    def _decodePoolNumpy_(self, s, nArrays, nPlanes, size): #returns numpy array [vertex, plane] with all values of pool atom s or None in case of error
+        dtype = np.dtype('<u2') if size == 2 else np.dtype('<u4')
+        b = np.frombuffer(s, np.uint8) #all bytes of atom to pick values of run-length encoded planes
+        P = np.empty((nArrays, nPlanes), dtype)
+        pos = 5 #position in string s after number of arrays and planes
+        for n in range(nPlanes):
+            encType = s[pos]
+            pos += 1
+            if self._DEBUG_: self._log_.debug("Plane {} is encoded: {}".format(n, encType))
+            if encType > 3: #encoding not defined
+                self._log_.error("Stopp reading pool because not known encoding of plane found!!!")
+                return None
+            if encType < 2: #values just stored one after another
+                values = np.frombuffer(s, dtype, nArrays, pos)
+                pos += nArrays * size
+            else: #run-length encoded; first only the headers of all runs are parsed
+                starts = [] #position in s of first value of each run
+                counts = [] #number of values of each run
+                steps = [] #size for runs of individual values, 0 for runs of repeated value
+                i = 0  #counts how many arrays = vertices have been read in plane n
+                while i < nArrays:
+                    runLength = s[pos]
+                    if runLength > 127: #means the following value is repeated
+                        runLength -= 128
+                        starts.append(pos + 1)
+                        steps.append(0)
+                        pos += 1 + size
+                    else:
+                        starts.append(pos + 1)
+                        steps.append(size)
+                        pos += 1 + runLength * size
+                    counts.append(runLength)
+                    i += runLength
+                counts = np.array(counts, np.int64)
+                steps = np.array(steps, np.int64)
+                first = np.cumsum(counts) - counts #index of first value of each run in plane
+                offsets = np.repeat(np.array(starts, np.int64) - steps * first, counts) + np.repeat(steps, counts) * np.arange(i, dtype=np.int64) #position in s of each value
+                values = np.zeros(i, dtype)
+                for k in range(size): #compose little endian values from their bytes
+                    values |= b[offsets + k].astype(dtype) << (8 * k)
+                values = values[:nArrays]
+            if encType == 1 or encType == 3: #values are also stored differenced; cumsum wraps like modulo for unsigned integers
+                values = np.cumsum(values, dtype=dtype)
+            P[:, n] = values
+        return P
+
+
+    def _encodeRunLengthNumpy_(self, values, size, limit = None): #returns bytes of run-length encoded numpy array values with size bytes per value; None if not shorter than limit bytes
+        if len(values) == 0:
+            return b''
+        starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1]))) #first index of each run of equal values
+        lengths = np.diff(np.append(starts, len(values)))
+        full, rest = np.divmod(lengths, 127) #runs are split in chunks of maximum 127 values
+        nchunks = full + (rest > 0)
+        if limit is not None and int(nchunks.sum()) * size + int((lengths > 1).sum()) >= limit: #at least each value and each repeated value needs header
+            return None
+        run = np.repeat(np.arange(len(starts)), nchunks) #for each chunk index of its run
+        j = np.arange(len(run)) - np.repeat(np.cumsum(nchunks) - nchunks, nchunks) #index of chunk within its run
+        chunklength = np.where(j < full[run], 127, rest[run])
+        chunkvalue = values[starts[run]]
+        single = chunklength == 1 #single values are stored together with neighbouring single values as individual values
+        newgroup = single & ~np.concatenate(([False], single[:-1]))
+        group = np.cumsum(newgroup) #number of group of neighbouring single values
+        groupstart = np.maximum.accumulate(np.where(newgroup, np.arange(len(run)), 0))
+        k = np.arange(len(run)) - groupstart #index within group of single values
+        grouplength = np.bincount(group[single], minlength=group[-1] + 1)[group]
+        header = ~single | (k % 127 == 0) #repeated values and each block of maximum 127 individual values start with header
+        headervalue = np.where(single, np.minimum(127, grouplength - k), 128 + chunklength)
+        chunkbytes = header + size
+        pos = np.cumsum(chunkbytes) - chunkbytes
+        out = np.empty(int(chunkbytes.sum()), np.uint8)
+        out[pos[header]] = headervalue[header]
+        pos += header
+        for b in range(size): #little endian bytes of values
+            out[pos + b] = (chunkvalue >> (8 * b)) & 255
+        return out.tobytes()
+
+
+    def _encodePoolNumpy_(self, P, pn, max_int): #returns pool atom for numpy array P [vertex, plane] of integers pn is number of pool; for each plane the shortest encoding is used
+        size = 2 if max_int == 65536 else 4
+        dtype = np.dtype('<u2') if size == 2 else np.dtype('<u4')
+        if P.size and P.min() < 0:
+            self._log_.warning("In pool {} {} negative values to be encoded. Set to 0.".format(pn, int((P < 0).sum())))
+        if P.size and P.max() >= max_int:
+            self._log_.warning("In pool {} {} values exceeding {} to be encoded. Set to {}.".format(pn, int((P >= max_int).sum()), max_int - 1, max_int - 1))
+        P = np.clip(P, 0, max_int - 1)
+        encpool = bytearray(pack("<IB", P.shape[0], P.shape[1]))
+        for n in range(P.shape[1]):
+            values = P[:, n]
+            differences = np.empty_like(values)
+            differences[:1] = values[:1]
+            differences[1:] = (values[1:] - values[:-1]) % max_int #wrapping for unsigned integers
+            limit = len(values) * size + 1 #run-length encoding only used if not longer than values stored one after another
+            encodings = [values.astype(dtype).tobytes(), differences.astype(dtype).tobytes(), self._encodeRunLengthNumpy_(values, size, limit), self._encodeRunLengthNumpy_(differences, size, limit)]
+            encType = min((e for e in (3, 2, 1, 0) if encodings[e] is not None), key=lambda e: len(encodings[e])) #preferring differentiated run-length encoding for same length
+            if self._DEBUG_: self._log_.debug("Plane {} of pool {} encoded with {}, bytes per encoding: {}".format(n, pn, encType, [len(e) if e is not None else None for e in encodings]))
+            encpool.append(encType)
+            encpool.extend(encodings[encType])
+        return encpool
+
+
     def _encodeRunLength_(self, l):  # yields runlength encoded value pairs of list l
         count = 1 #counting repetitions
         prev = l[0] #the previous value in list starts with first value in the list
-        l.append('_END_') #as end of list symbol
         individuals = [] #list of individual values (non repeating ones)
-        for value in l[1:]:
+        for value in l[1:] + ['_END_']: #'_END_' as end of list symbol, list l itself is not changed
             if value != prev or count == 127: #non repeating value or maximum of repeating values reached
                 if len(individuals) == 127:  #if maximum length of indivdiual values is reached
                     yield(len(individuals),individuals)
@@ -383,12 +835,21 @@ class XPLNEDSF:
         self._Atoms_[atom] = [] #start new (future version also think of creating Pool atom in case it new dsf file will be created !!!!!!!!!!)
         ####### This version only stores pools in differentiated run-length encoding !!! #############
         ## Start with differentiation of all values ##
-        for p in V: # go through all pools
+        for pn, p in enumerate(V): # go through all pools
             if len(p) == 0: #some standard dsf files have empty pools, keep them
-                self._log_.info("Empty pool number {} encoded.".format(V.index(p)))
+                self._log_.info("Empty pool number {} encoded.".format(pn))
                 encpool = pack("<IB",0,0) #pool has no vertices with no planes (is empty)
                 self._Atoms_[atom].append(encpool)
                 continue
+            if NUMPYINSTALLED: #encode all planes vectorized
+                if isinstance(p, XPLNEpool): #encoding requires integer values, which are the raw values after de-scaling
+                    P = (p.raw if p.raw is not None else np.rint(p.array)).astype(np.int64)
+                else:
+                    P = np.rint(np.array(p, np.float64)).astype(np.int64)
+                encpool = self._encodePoolNumpy_(P, pn, max_int)
+                self._updateProgress_(len(encpool))
+                self._Atoms_[atom].append(encpool)
+                continue
             encpool = bytearray() ### NEW ###
             encpool.extend(pack("<IB",len(p),len(p[0]))) ### NEW ###  ## start string of binary encoded pool number of arrays and number of planes (taken from first vertex)
             #encpool = pack("<IB",len(p),len(p[0])) ## start string of binary encoded pool number of arrays and number of planes (taken from first vertex)
@@ -400,10 +861,10 @@ class XPLNEDSF:
                 #encpool += pack('<B',3) #plane will be encoded differntiated + runlength
                 encpool.extend(pack('<B',3)) #### NEW ### #plane will be encoded differntiated + runlength
                 if p[0][n] < 0:  #### NEW 4.3 #####
-                    self._log_.warning("In pool {} negative value {} to be encoded. Set to 0.".format(self.V.index(p), p[0][n]))   
+                    self._log_.warning("In pool {} negative value {} to be encoded. Set to 0.".format(pn, p[0][n]))   
                     p[0][n] = 0
                 if p[0][n] >= max_int: #### NEW 4.3 #####
-                    self._log_.warning("In pool {} exceeding value {}  to be encoded. Set to {}.".format(self.V.index(p), p[0][n], max_int-1))
+                    self._log_.warning("In pool {} exceeding value {}  to be encoded. Set to {}.".format(pn, p[0][n], max_int-1))
                     p[0][n] = max_int - 1 
                 pack(ctype,p[0][n])  ########### WHAT IS THIS FOR ??? ################
                 ## Now perform run-length encoding ##
@@ -414,10 +875,10 @@ class XPLNEDSF:
                     encpool.extend(pack('<B', rlpair[0]))  ### NEW ###
                     for v in rlpair[1]:
                         if v < 0:   #### NEW 4.3 #####
-                            self._log_.warning("In pool {} negative value {} to be encoded. Set to 0.".format(self.V.index(p), v))  
+                            self._log_.warning("In pool {} negative value {} to be encoded. Set to 0.".format(pn, v))  
                             v = 0
                         if v >= max_int: #### NEW 4.3 #####
-                            self._log_.warning("In pool {} exceeding value {}  to be encoded. Set to {}.".format(self.V.index(p), v, max_int-1))
+                            self._log_.warning("In pool {} exceeding value {}  to be encoded. Set to {}.".format(pn, v, max_int-1))
                             v = max_int - 1                               
                         #encpool += pack(ctype, v)  ### OLD ###
                         encpool.extend(pack(ctype, v)) ##### NEW ###
@@ -456,7 +917,7 @@ class XPLNEDSF:
             self._Atoms_['23CS'].append(encscal)                    
 
                 
-    def _scaleV_(self, bit = 16, reverse = False): #applies scaling to the vertices stored in V and V32
+    def _scaleV_(self, bit = 16, reverse = False, listsonly = False): #applies scaling to the vertices stored in V and V32; listsonly True skips pools stored as XPLNEpool
         if reverse:
             self._log_.info("Start to de-scale all {} bit pools.".format(bit))
         else:
@@ -474,9 +935,20 @@ class XPLNEDSF:
             self._log_.error("Amount of Scale atoms does not equal amount of Pools!!")
             return 1
         for p in range(len(V)): #for all Pools
-            if V[p] == []: ###There can exist empty pools that have to be skipped for scaling!!!
+            if len(V[p]) == 0: ###There can exist empty pools that have to be skipped for scaling!!!
                 self._log_.info("Empty pool number {} not scaled!".format(p))
-                break
+                continue
+            if isinstance(V[p], XPLNEpool): #whole planes are scaled at once
+                if listsonly:
+                    continue
+                if V[p].shape[1] != len(Scalings[p]):
+                    self._log_.error("Amount of scale values for pool {} does not equal the number of coordinate planes!!!".format(p))
+                    return 2
+                if reverse: #in case scaling is still deferred, values are already the ones to be written
+                    V[p]._descale_(Scalings[p], max_int)
+                else:
+                    V[p]._scale_(Scalings[p], max_int, self._floatType_, self._deferScaling_)
+                continue
             if len(V[p][0]) != len(Scalings[p]): #take first vertex as example to determine number of coordinate planes in current pool
                 self._log_.error("Amount of scale values for pool {} does not equal the number of coordinate planes!!!".format(p))
                 return 2
@@ -484,7 +956,7 @@ class XPLNEDSF:
                 if self._DEBUG_: self._log_.debug("Will now scale pool {} plane {} with multiplier: {} and offset: {}".format(p, n ,Scalings[p][n][0], Scalings[p][n][1]))                              
                 if float(Scalings[p][n][0]) == 0.0:
                     if self._DEBUG_: self._log_.debug("   Plane will not be scaled because scale is 0!")
-                    break
+                    continue
                 for v in range(len(V[p])): #for all vertices in current plane
                     if reverse: #de-scale vertices
                         V[p][v][n] = round((V[p][v][n] - Scalings[p][n][1]) * max_int / Scalings[p][n][0])   #de-scale vertex v in pool p for plane n by subtracting offset and dividing by multiplyer
@@ -529,6 +1001,20 @@ class XPLNEDSF:
                     self._log_.error("Not allowed bytes per pixel in Raster Definition!!!")
                     return 4
 
+            if self._rasters_ is not None and self.DefRasters.get(rn) not in self._rasters_: #layer not selected keeps only its info, so that index of layers stays the same
+                self._log_.info("Raster layer {} not selected, only info is kept.".format(self.DefRasters.get(rn)))
+                self._updateProgress_(len(self._Atoms_['DMED'][rn]))
+                self.Raster.append(R)
+                continue
+            if NUMPYINSTALLED: #all pixels are decoded at once; data is indexed [x][y] as transposed view of the rows from south to north
+                if len(self._Atoms_['DMED'][rn]) < R.bpp * R.width * R.height:
+                    self._log_.error("Raster data atom number {} is shorter than defined by width {} and height {}!!!".format(rn, R.width, R.height))
+                    return 5
+                values = np.frombuffer(self._Atoms_['DMED'][rn], np.dtype(ctype), R.width * R.height).reshape(R.height, R.width)
+                R.data = (values * np.float64(R.scale) + np.float64(R.offset)).T # APPLYING SCALE + OFFSET
+                self._updateProgress_(R.bpp * R.width * R.height)
+                self.Raster.append(R)
+                continue
             for x in range(0, R.bpp * R.width, R.bpp): #going x-wise from east to west just the bytes per pixes
                 line = []
                 for y in range(0, R.bpp * R.height * R.width, R.bpp * R.width): #going y-wise from south to north, always jumping over the width of each x-line
@@ -578,86 +1064,115 @@ class XPLNEDSF:
                     self._log_.error("Not allowed bytes per pixel in Raster Definition!!!")
                     return 4
                 
-            encdata = bytearray()
-
-            for y in range(R.height): #going x-wise from east to west just the bytes per pixes ################# YYYYYYY
-                line = b'' #current encoded bytes just for one line; this is quick enough wiht +=, then extend lines to encdata
-                for x in range(R.width): #going y-wise from south to north, always jumping over the width of each x-line ################## XXXXXX
-                    #v = R.data[x][y] / R.scale - R.offset # APPLYING SCALE + OFFSET to raster elevation at position x, y
-                    v = (R.data[x][y] - R.offset) / R.scale # APPLYING SCALE + OFFSET to raster elevation at position x, y  ## corrected 26.04.2020
-                    if R.flags & 1 or R.flags & 2: #integers to be read
-                        v = int(v)
-                        if ctype == '<H': ##  check here out of bound values  ###### NEW 26.04.2020 ######
-                            if v < 0:
-                                self._log_.error("Raster elevation at position {} {} is negative: {} ({})---> set to 0".format(x, y, v, ctype))
-                                v = 0
-                            if v > 65535:
-                                self._log_.error("Raster elevation at position {} {} is above 65535: {} ({}) ---> set to 65535".format(x, y, v, ctype))
-                                v = 65535
-                        if ctype == '<h': ##  check here out of bound values  ###### NEW 26.04.2020 ######
-                            if v < -32768:
-                                self._log_.error("Raster elevation at position {} {} is below -32768: {} ({})---> set to -32768".format(x, y, v, ctype))
-                                v = -32768
-                            if v > 32767:
-                                self._log_.error("Raster elevation at position {} {} is above 32767: {} ({}) ---> set to 32767".format(x, y, v, ctype))
-                                v = 32767
-                    ##### TBD: check if v is not negative for signed integer and if size for packing is according....
-                    line += pack(ctype, v) #pack bytes for position x, y of raster
-                encdata.extend(line)
-                self._updateProgress_(R.bpp * R.width) #update progress with number of bytes per raster line
-                #self._log_.info("Raster line {} encoded".format(x))
-            #self._log_.info("Last Raster line encoded: {}".format(line))
+            low, high = self._RasterLimits_.get(ctype, (None, None)) #values of integer rasters out of this range are clipped
+            clipped = [0, None, None, None, None, None, None] #count, min and max value, min and max x, min and max y of clipped pixels
+            if NUMPYINSTALLED: #all pixels are encoded at once
+                values = (np.asarray(R.data, np.float64).T - R.offset) / R.scale # APPLYING SCALE + OFFSET to raster elevations, rows of array are from south to north
+                if values.shape != (R.height, R.width):
+                    self._log_.error("Raster data of layer {} with shape {} does not fit to width {} and height {}!!!".format(rn, values.shape[::-1], R.width, R.height))
+                    return 5
+                if low is not None:
+                    values = np.trunc(values) #same as int() for single values
+                    out = (values < low) | (values > high)
+                    if out.any():
+                        y, x = np.nonzero(out)
+                        clipped = [len(x), int(values[out].min()), int(values[out].max()), int(x.min()), int(x.max()), int(y.min()), int(y.max())]
+                        values = np.clip(values, low, high)
+                encdata = values.astype(np.dtype(ctype)).tobytes()
+                self._updateProgress_(len(encdata))
+            else:
+                encdata = bytearray()
+                for y in range(R.height): #going x-wise from east to west just the bytes per pixes ################# YYYYYYY
+                    line = b'' #current encoded bytes just for one line; this is quick enough wiht +=, then extend lines to encdata
+                    for x in range(R.width): #going y-wise from south to north, always jumping over the width of each x-line ################## XXXXXX
+                        v = (R.data[x][y] - R.offset) / R.scale # APPLYING SCALE + OFFSET to raster elevation at position x, y  ## corrected 26.04.2020
+                        if low is not None: #integers to be packed
+                            v = int(v)
+                            if v < low or v > high: #out of bound values are clipped and reported together below
+                                if not clipped[0]:
+                                    clipped = [0, v, v, x, x, y, y]
+                                clipped = [clipped[0] + 1, min(clipped[1], v), max(clipped[2], v), min(clipped[3], x), max(clipped[4], x), min(clipped[5], y), max(clipped[6], y)]
+                                v = min(max(v, low), high)
+                        line += pack(ctype, v) #pack bytes for position x, y of raster
+                    encdata.extend(line)
+                    self._updateProgress_(R.bpp * R.width) #update progress with number of bytes per raster line
+            if clipped[0]:
+                self._log_.error("{} values of raster layer {} out of range for {} with minimum {} and maximum {} in pixels x {} to {} and y {} to {} ---> clipped to {} and {}".format(clipped[0], rn, ctype, *clipped[1:], low, high))
             self._Atoms_['DMED'].append(encdata) #raster data for raster number rn added to atom
         self._log_.info("Finished packing Rasters.")   
    
    
-    def _unpackCMDS_(self):
+    def _iterCMDS_(self, skip = ()): #yields commands of SDMC atom one by one as list with id followed by values; decoded in one pass with Struct objects compiled only once per command id; commands with id in skip are just jumped over
+        if not self._CMDStructs_: #shared by all instances, so compiled only with first call; added at once for other threads
+            self._CMDStructs_.update({id : (Struct('<' + structure[0]) if structure[0] else None, Struct('<' + structure[1]) if len(structure) == 3 else None,
+                                            Struct('<' + structure[2]).size if len(structure) == 3 else 0) for id, structure in self._CMDStructure_.items()})
+        sdmc = memoryview(self._Atoms_['SDMC'])
         i = 0 #position in CMDS String
-        self._log_.info("Start unpacking of Commands.")
         current100kBjunk = 1 #counts processed bytes in 100kB junks
-        while i < len(self._Atoms_['SDMC']):
-            id, = unpack('<B', self._Atoms_['SDMC'][i : i+1])
-            self.CMDS.append([id])
+        while i < len(sdmc):
+            if i > current100kBjunk * 100000:
+                self._updateProgress_(100000)
+                current100kBjunk += 1
+            id = sdmc[i]
             i += 1
-            if id in self._CMDStructure_:
-                l = self._CMDStructLen_[id][0] #length of bytes to read
-                if l > 0:
-                    y = unpack('<' + self._CMDStructure_[id][0], self._Atoms_['SDMC'][i : i + l])
-                    self.CMDS[-1].extend(y)
-                    i += l
-                if len(self._CMDStructLen_[id]) == 3: #read command with variable length
-                    l = self._CMDStructLen_[id][1] #length of repeating value n to read
-                    n, = unpack('<' + self._CMDStructure_[id][1], self._Atoms_['SDMC'][i : i + l]) #number n of repetitions
-                    if id == 15:
-                        n += 1 #id = 15 seems a special case that there is one index more than windings  ########??????????
-                    i += l
-                    l = self._CMDStructLen_[id][2] #length of repeated bytes
-                    for j in range(n): 
-                       y = unpack('<' + self._CMDStructure_[id][2], self._Atoms_['SDMC'][i : i + l])
-                       self.CMDS[-1].extend(y)
-                       i += l
-            else:
-                if id == 14: #special double packed case, which is explicetly treated separate and has special format returning lists inside commands !!!
-                             ###### not tested yet !!!!!!!! ########
-                    parameter, windings = unpack('<HB', self._Atoms_['SDMC'][i : i + 3])
+            if id in skip: #only lengths of values are read
+                if id in self._CMDStructs_:
+                    fixed, repetitions, size = self._CMDStructs_[id]
+                    if fixed is not None:
+                        i += fixed.size
+                    if repetitions is not None:
+                        n, = repetitions.unpack_from(sdmc, i)
+                        i += repetitions.size + (n + 1 if id == 15 else n) * size
+                elif id == 14:
+                    windings = sdmc[i + 2]
                     i += 3
-                    self.CMDS[-1].extend(parameter)
                     for w in range(windings):
-                        indices, = unpack('<B', self._Atoms_['SDMC'][i : i + 1])
-                        i += 1
-                        windinglist = []
-                        for m in range(indices):
-                            y, = unpack('<H', self._Atoms_['SDMC'][i : i + 2])
-                            i += 2
-                            windinglist.extend(y)
-                        self.CMDS[-1].append(windinglist)
-                else: #command id not tretated here until now
-                    self._log_.warning("Unknown command ID {} ignored!".format(id))
-                    self.CMDS[-1] #delete already written id
-            if self._DEBUG_: self._log_.debug("CMD id {}: {} (string pos next cmd: {})".format(self.CMDS[-1][0], self.CMDS[-1][1:], i))
-            if i > current100kBjunk * 100000:
-                self._updateProgress_(50000) #count only half of the length, other half by extractCMDS
-                current100kBjunk += 1
+                        i += 1 + 2 * sdmc[i]
+                continue
+            c = [id]
+            if id in self._CMDStructs_:
+                fixed, repetitions, size = self._CMDStructs_[id]
+                if fixed is not None:
+                    c.extend(fixed.unpack_from(sdmc, i))
+                    i += fixed.size
+                if repetitions is not None: #read command with variable length
+                    n, = repetitions.unpack_from(sdmc, i) #number n of repetitions
+                    i += repetitions.size
+                    if id == 15:
+                        n += 1 #id = 15 seems a special case that there is one index more than windings  ########??????????
+                    values = self._CMDStructs_.get((id, n))
+                    if values is None:
+                        values = self._CMDStructs_[(id, n)] = Struct('<' + self._CMDStructure_[id][2] * n)
+                    c.extend(values.unpack_from(sdmc, i))
+                    i += values.size
+            elif id == 14: #special double packed case, which is explicetly treated separate and has special format returning lists inside commands !!!
+                           ###### not tested yet !!!!!!!! ########
+                parameter, windings = unpack('<HB', sdmc[i : i + 3])
+                i += 3
+                c.append(parameter)
+                for w in range(windings):
+                    indices = sdmc[i]
+                    i += 1
+                    c.append(list(unpack('<{}H'.format(indices), sdmc[i : i + 2 * indices])))
+                    i += 2 * indices
+            else: #command id not tretated here until now
+                self._log_.warning("Unknown command ID {} ignored!".format(id))
+            if self._DEBUG_: self._log_.debug("CMD id {}: {} (string pos next cmd: {})".format(c[0], c[1:], i))
+            yield c
+
+    def _skippedCMDS_(self): #returns set of command ids for content not selected in read()
+        if self._extract_ is None:
+            return set()
+        return set(id for content, ids in self._ContentCMDS_.items() if content not in self._extract_ for id in ids)
+
+    def _unselectedStages_(self): #returns set of stages not unpacked with read(), but only with first access, as their content is not selected
+        if self._extract_ is not None and 'networks' not in self._extract_: #32-bit pools are only used by networks
+            return {'pools32'}
+        return set()
+
+    def _unpackCMDS_(self): #stores all commands in CMDS; only done when read with keepcmds=True for debugging, otherwise commands are extracted directly
+        self._log_.info("Start unpacking of Commands.")
+        self.CMDS = list(self._iterCMDS_())
         self._log_.info("{} commands haven been unpacked.".format(len(self.CMDS)))
 
 
@@ -677,11 +1192,8 @@ class XPLNEDSF:
         defIndex = 0
         subroadtype = 0
         junctionoffset = 0
-        counter = 0
-        amount_of_two_percent_CMDS = int(len(self.CMDS)/50)  ### NEW ###
-        if amount_of_two_percent_CMDS == 0:                  ### NEW ###
-            amount_of_two_percent_CMDS = 1 #have 1 as minimal value in order to avoid devision by zero below   ### NEW ###
-        for c in self.CMDS:
+        skip = self._skippedCMDS_() #commands of content not selected
+        for c in ((c for c in self.CMDS if c[0] not in skip) if self._keepCMDS_ else self._iterCMDS_(skip)): #progress is updated while decoding commands
             if c[0] == 1: # new pool selection
                 poolIndex = c[1]
             elif c[0] == 2: # new junction offset
@@ -723,9 +1235,6 @@ class XPLNEDSF:
                     self._log_.error("Definition Index changed within patch. Aborted command extraction!")
                     return 1
                 self.Patches[-1].cmds.append(c) 
-            counter += 1
-            if not counter % amount_of_two_percent_CMDS: #after every 2% processed of commands update progress  --> RAISES ERROR when less than 50 CMDS
-                self._updateProgress_(round(len(self._Atoms_['SDMC']) / 100)) #count only half of the length, other half by unpackCMDS
         self._log_.info("{} patches extracted from commands.".format(len(self.Patches)))
         self._log_.info("{} different Polygon types including there definitions extracted from commands.".format(len(self.Polygons)))
         self._log_.info("{} different Objects with placements coordinates extracted from commands.".format(len(self.Objects)))
@@ -831,10 +1340,266 @@ class XPLNEDSF:
                     poolIndex = c[1] #therefore also state variable has to be adapted        
         self._Atoms_['SDMC'] = enccmds #Commands Atom now set to the now packed CMDS
         self._log_.info("Ended to pack CMDS")
- ########### END of NEW function _packCMDS_() #################               
-                
+ ########### END of NEW function _packCMDS_() #################
+
+    def _optimizePools_(self, optimize): #reorders vertices in 16 bit pools before encoding: 'morton' by spatial order of lon/lat, 'firstuse' by first reference in commands; references in Objects, Polygons and Patches are adapted
+        if optimize not in ('morton', 'firstuse'):
+            self._log_.error("Pool optimization {} not supported. Pools are not reordered.".format(optimize))
+            return 1
+        self._log_.info("Start to reorder vertices in pools by {} order.".format(optimize))
+        def interleave(v): #spreads the 16 bits of v to every second bit; works for integers and numpy arrays
+            v = (v | (v << 8)) & 0x00FF00FF
+            v = (v | (v << 4)) & 0x0F0F0F0F
+            v = (v | (v << 2)) & 0x33333333
+            return (v | (v << 1)) & 0x55555555
+        fixed = set() #pools referenced by range or nested commands keep their order, as reordering would require to expand ranges to single indices
+        used = [[] for p in self.V] #indices of vertices for each pool in the order they are referenced by the commands as written
+        for d in self.Objects:
+            for c in d:
+                if c[1] == 7: #OBJECT
+                    used[c[0]].append(c[2])
+                else:
+                    fixed.add(c[0])
+        for d in self.Polygons:
+            for c in d:
+                if c[1] == 12: #POLYGON
+                    used[c[0]].extend(c[3:])
+                else:
+                    fixed.add(c[0])
+        for d in self.Patches:
+            p = None #current pool is defined by first command of patch
+            for c in d.cmds:
+                if c[0] == 1:
+                    p = c[1]
+                elif c[0] in (23, 26, 29): #PATCH TRIANGLE, STRIP or FAN in current pool
+                    used[p].extend(c[1:])
+                elif c[0] in (24, 27, 30): #PATCH TRIANGLE, STRIP or FAN CROSS POOL with pairs of pool and index
+                    for v in range(1, len(c), 2):
+                        used[c[v]].append(c[v + 1])
+                else:
+                    fixed.add(p)
+        remap = [None] * len(self.V) #for each reordered pool list with new index at old index of vertex
+        for pn, p in enumerate(self.V):
+            if pn in fixed:
+                self._log_.info("Pool {} referenced by range or nested commands keeps its order.".format(pn))
+                continue
+            if len(p) < 2:
+                continue
+            if used[pn] and max(used[pn]) >= len(p):
+                self._log_.warning("Pool {} is referenced with index {} exceeding its {} vertices. Pool keeps its order.".format(pn, max(used[pn]), len(p)))
+                continue
+            if optimize == 'firstuse':
+                order = list(dict.fromkeys(used[pn])) #vertices in order of first reference followed by vertices not referenced
+                referenced = set(order)
+                order.extend(i for i in range(len(p)) if i not in referenced)
+            elif isinstance(p, XPLNEpool): #after de-scaling values of lon/lat planes are the integers as stored in file
+                P = (p.raw if p.raw is not None else np.rint(p.array)).astype(np.int64) & 0xFFFF
+                order = np.argsort(interleave(P[:, 0]) | (interleave(P[:, 1]) << 1), kind = 'stable').tolist()
+            else:
+                order = sorted(range(len(p)), key = lambda i: interleave(int(p[i][0]) & 0xFFFF) | (interleave(int(p[i][1]) & 0xFFFF) << 1))
+            if order == list(range(len(p))):
+                continue
+            remap[pn] = [0] * len(p)
+            for n, i in enumerate(order):
+                remap[pn][i] = n
+            if isinstance(p, XPLNEpool):
+                p._reorder_(np.array(order))
+            else:
+                self.V[pn] = [p[i] for i in order]
+        for d in self.Objects:
+            for c in d:
+                if remap[c[0]] is not None and c[1] == 7:
+                    c[2] = remap[c[0]][c[2]]
+        for d in self.Polygons:
+            for c in d:
+                if remap[c[0]] is not None and c[1] == 12:
+                    c[3:] = [remap[c[0]][i] for i in c[3:]]
+        for d in self.Patches:
+            p = None
+            for c in d.cmds:
+                if c[0] == 1:
+                    p = c[1]
+                elif c[0] in (23, 26, 29):
+                    if remap[p] is not None:
+                        c[1:] = [remap[p][i] for i in c[1:]]
+                elif c[0] in (24, 27, 30):
+                    for v in range(1, len(c), 2):
+                        if remap[c[v]] is not None:
+                            c[v + 1] = remap[c[v]][c[v + 1]]
+        self._log_.info("{} of {} pools reordered.".format(len([r for r in remap if r is not None]), len(self.V)))
+        return 0
+
+
+    def _unpackStage_(self, stage): #unpacks and extracts the atoms for one stage, if it is still pending
+        with self._lock_: #other threads accessing the same attributes in lazy mode wait until they are unpacked
+            if stage not in self._pendingStages_:
+                return 0
+            dsf = object.__new__(type(self)) #attributes are extracted on a shallow copy and only set at the end, so other threads never see them half filled
+            dsf.__dict__.update(self.__dict__) #not with copy(), which would call __getstate__ and copy all atoms
+            for name in self._StageAttributes_[stage]: #start with empty attributes (in lazy mode they had been removed)
+                setattr(dsf, name, [])
+            error = 0
+            if stage == 'raster':
+                error = dsf._extractRaster_()
+            elif stage == 'pools16':
+                dsf._extractPools_(16)
+                dsf._extractScalings_(16)
+                dsf._scaleV_(16, False) #False that scaling is not reversed
+                dsf._updateProgress_(len(self._Atoms_['LACS']))
+            elif stage == 'pools32':
+                dsf._extractPools_(32)
+                dsf._extractScalings_(32)
+                dsf._scaleV_(32, False) #False that scaling is not reversed
+                dsf._updateProgress_(len(self._Atoms_['23CS']))
+            elif stage == 'cmds':
+                if dsf._keepCMDS_:
+                    dsf._unpackCMDS_()
+                error = dsf._extractCMDS_()
+            for name in self._StageAttributes_[stage]:
+                if name not in self.__dict__: #attributes were removed when atoms were read, so values in instance dict had been set meanwhile and are kept
+                    setattr(self, name, getattr(dsf, name))
+            self._pendingStages_.remove(stage)
+            del dsf #views of copy on memory map are released
+            self._releaseMap_()
+            return error
 
-    def _unpackAtoms_(self): #starts all functions to unpack and extract data froms strings in Atoms
+
+    def _unpackParallel_(self, workers): #unpacks pending stages in worker processes; each raster layer and each pool is a task of its own
+        if not SHAREDMEMORY:
+            self._log_.warning("Parallel unpacking requires python 3.8 or newer, unpacking atoms one after another.")
+            return 1
+        stages = [stage for stage in ('cmds', 'pools16', 'pools32', 'raster') if stage in self._pendingStages_ and stage not in self._unselectedStages_()] #start longest running stage first
+        atomsize = 0 #size of shared memory to copy atoms of all stages to
+        resultsize = 0 #size of shared memory where workers put extracted pools and raster data as doubles
+        for stage in stages:
+            for k in self._StageAtoms_[stage]:
+                if k in self._MultiAtoms_:
+                    atomsize += sum(len(a) for a in self._Atoms_[k])
+                else:
+                    atomsize += len(self._Atoms_[k])
+        if atomsize == 0:
+            return 0
+        self._log_.info("Start to unpack {} in {} parallel processes.".format(stages, workers))
+        atomshm = SharedMemory(create=True, size=atomsize)
+        resultshm = None
+        try:
+            pos = 0
+            offsets = {} #offset and length of each atom in shared memory, for multi atoms as list
+            for stage in stages:
+                for k in self._StageAtoms_[stage]:
+                    if k in self._MultiAtoms_:
+                        offsets[k] = []
+                        for a in self._Atoms_[k]:
+                            atomshm.buf[pos : pos + len(a)] = a
+                            offsets[k].append((pos, len(a)))
+                            pos += len(a)
+                    else:
+                        atomshm.buf[pos : pos + len(self._Atoms_[k])] = self._Atoms_[k]
+                        offsets[k] = (pos, len(self._Atoms_[k]))
+                        pos += len(self._Atoms_[k])
+            tasks = [] #list of stage, index of layer or pool, atoms as offsets in shared memory, offset and shape of result, scale flag for pools, definitions for commands
+            for stage in stages:
+                if stage == 'cmds':
+                    tasks.append(('cmds', 0, {'SDMC' : offsets['SDMC']}, None, None, {'DefPolygons' : self.DefPolygons, 'DefObjects' : self.DefObjects, '_keepCMDS_' : self._keepCMDS_, '_extract_' : self._extract_}))
+                elif stage == 'raster':
+                    if len(offsets['IMED']) != len(offsets['DMED']): #leave error handling to sequential unpacking
+                        continue
+                    for rn in range(len(offsets['IMED'])):
+                        width, height = unpack('<LL', self._Atoms_['IMED'][rn][4:12])
+                        if self._rasters_ is not None and self.DefRasters.get(rn) not in self._rasters_: #layer not selected keeps only its info, without data in shared memory
+                            width, height = 0, 0
+                        tasks.append(('raster', rn, {'IMED' : [offsets['IMED'][rn]], 'DMED' : [offsets['DMED'][rn]]}, resultsize, (width, height), {'DefRasters' : {0 : self.DefRasters.get(rn)}, '_rasters_' : self._rasters_}))
+                        resultsize += 8 * width * height
+                else:
+                    pool, scal = self._StageAtoms_[stage]
+                    if len(offsets[pool]) != len(offsets[scal]): #leave error handling to sequential unpacking
+                        continue
+                    for p in range(len(offsets[pool])):
+                        nArrays, nPlanes = unpack('<IB', self._Atoms_[pool][p][0:5])
+                        tasks.append((stage, p, {pool : [offsets[pool][p]], scal : [offsets[scal][p]]}, resultsize, (nArrays, nPlanes), {'_deferScaling_' : self._deferScaling_, '_floatType_' : self._floatType_}))
+                        resultsize += 8 * nArrays * nPlanes
+            if resultsize:
+                resultshm = SharedMemory(create=True, size=resultsize)
+            results = {stage : {} for stage in stages} #results of all tasks per stage with index of task
+            with ProcessPoolExecutor(workers) as executor:
+                futures = [(task[0], task[1], task[4], task[3], executor.submit(_unpackTask_, self._logname_, self._log_.getEffectiveLevel(), atomshm.name, resultshm.name if resultshm else None, task)) for task in tasks]
+                for stage, index, shape, offset, future in futures:
+                    try:
+                        result = future.result()
+                    except Exception as err:
+                        if results[stage] is not None:
+                            self._log_.error("Unpacking {} in parallel process failed: {}".format(stage, err))
+                        results[stage] = None #stage will be unpacked again sequentially
+                    else:
+                        if results[stage] is not None:
+                            results[stage][index] = (shape, offset, result)
+            for stage in stages:
+                if results[stage] is None or (stage != 'cmds' and len(results[stage]) != len(self._Atoms_[self._StageAtoms_[stage][0]])):
+                    continue
+                error = 0
+                if stage == 'cmds':
+                    error, values = results[stage][0][2]
+                    for name in self._StageAttributes_[stage]:
+                        setattr(self, name, values[name])
+                elif stage == 'raster':
+                    if any(results[stage][rn][2][0] for rn in results[stage]): #leave error handling to sequential unpacking
+                        continue
+                    Raster = []
+                    for rn in range(len(results[stage])):
+                        (width, height), offset, (e, R) = results[stage][rn]
+                        if NUMPYINSTALLED and width * height:
+                            R.data = np.frombuffer(resultshm.buf, np.float64, width * height, offset).reshape(width, height).copy()
+                        elif width * height:
+                            with resultshm.buf[offset : offset + 8 * width * height] as b, b.cast('d', [width, height]) as data:
+                                R.data = data.tolist()
+                        else:
+                            R.data = [[] for x in range(width)]
+                        Raster.append(R)
+                    self.Raster = Raster
+                else:
+                    V = []
+                    Scalings = []
+                    for p in range(len(results[stage])):
+                        (nArrays, nPlanes), offset, (pool, scaling, intplanes, dtype) = results[stage][p]
+                        if pool is None and dtype is not None: #values of XPLNEpool are in shared memory with dtype
+                            dtype = np.dtype(dtype)
+                            pool = XPLNEpool(np.frombuffer(resultshm.buf, dtype, nArrays * nPlanes, offset).reshape(nArrays, nPlanes).copy())
+                        elif pool is None: #pool values are in shared memory
+                            if nArrays * nPlanes:
+                                with resultshm.buf[offset : offset + 8 * nArrays * nPlanes] as b, b.cast('d', [nArrays, nPlanes]) as values:
+                                    pool = values.tolist()
+                                for n in intplanes: #not scaled planes keep their integer values
+                                    for v in pool:
+                                        v[n] = int(v[n])
+                            else:
+                                pool = [[] for i in range(nArrays)]
+                        V.append(pool)
+                        Scalings.append(scaling)
+                    if stage == 'pools16':
+                        self.V, self.Scalings = V, Scalings
+                    else:
+                        self.V32, self.Scal32 = V, Scalings
+                    if self._deferScaling_: #workers returned values as read, which are now set to be scaled with first access
+                        self._scaleV_(16 if stage == 'pools16' else 32, False)
+                if error:
+                    self._log_.error("Unpacking {} in parallel process returned error {}.".format(stage, error))
+                for k in self._StageAtoms_[stage]:
+                    if k in self._MultiAtoms_:
+                        self._updateProgress_(sum(len(a) for a in self._Atoms_[k]))
+                    else:
+                        self._updateProgress_(len(self._Atoms_[k]))
+                self._pendingStages_.remove(stage)
+        finally:
+            atomshm.close()
+            atomshm.unlink()
+            if resultshm:
+                resultshm.close()
+                resultshm.unlink()
+        self._log_.info("Finished unpacking in parallel processes.")
+        return 0
+
+
+    def _unpackAtoms_(self, lazy = False, parallel = 0): #starts all functions to unpack and extract data froms strings in Atoms; if lazy only for properties and definitions; parallel is number of processes
         self._log_.info("Extracting properties and definitions.")
         if 'PORP' in self._Atoms_:
             self._extractProps_()
@@ -845,41 +1610,51 @@ class XPLNEDSF:
         else:
             self._log_.warning("This dsf file has no definitions.") 
         if 'IMED' in self._Atoms_:
-            self._extractRaster_()
+            self._pendingStages_.add('raster')
         else:
             self._log_.info("This dsf file has no raster layers.")
         if 'LOOP' in self._Atoms_:
-            self._extractPools_(16)
-            self._extractScalings_(16)
-            self._scaleV_(16, False) #False that scaling is not reversed
-            self._updateProgress_(len(self._Atoms_['LACS']))
+            self._pendingStages_.add('pools16')
         else:
             self._log_.warning("This dsf file has no coordinate pools (16-bit) defined!") 
         if '23OP' in self._Atoms_:
-            self._extractPools_(32)
-            self._extractScalings_(32)
-            self._scaleV_(32, False) #False that scaling is not reversed
-            self._updateProgress_(len(self._Atoms_['23CS']))
+            self._pendingStages_.add('pools32')
         else:
             self._log_.info("This dsf file has no 32-bit pools.")
         if 'SDMC' in self._Atoms_:
-            self._unpackCMDS_()
-            self._extractCMDS_()
+            self._pendingStages_.add('cmds')
         else:
             self._log_.warning("This dsf file has no commands defined.")
+        if parallel and not lazy:
+            self._unpackParallel_(parallel)
+        for stage in self._StageAttributes_: #same order as before: raster, pools16, pools32, cmds; in parallel mode only stages that failed there
+            if stage in self._pendingStages_:
+                for name in self._StageAttributes_[stage]: #remove attributes, so that their first access will unpack the stage in lazy mode
+                    delattr(self, name)
+                if not lazy and stage not in self._unselectedStages_():
+                    self._unpackStage_(stage)
+        if lazy or self._unselectedStages_():
+            self._log_.info("Lazy mode: {} will be unpacked with first access.".format(sorted(self._pendingStages_)))
+        self._releaseMap_()
         return 0
         
 
-    def _packAtoms_(self): #starts all functions to write all variables to strings (for later been written to file)
+    def _packAtoms_(self, optimize = None): #starts all functions to write all variables to strings (for later been written to file); optimize is order of vertices in pools, see _optimizePools_()
         ###### TBD: only pack atoms if changed --> saves time !! ############
         self._log_.info("Preparing data to be written to file.")
         self._log_.info("This version does not yet support nested polygons (Command ID 14)!")
+        for stage in self._StageAttributes_: #all atoms not yet unpacked in lazy mode have to be unpacked now
+            self._unpackStage_(stage)
         self._encodeProps_()
         self._encodeDefs_() 
         self._scaleV_(16, True) #de-scale again      
         self._scaleV_(32, True)
+        if optimize:
+            self._optimizePools_(optimize)
         self._encodePools_(16)
         self._encodePools_(32)
+        self._scaleV_(16, False, True) #scale pools stored as lists again, XPLNEpool keeps its scaled values also after de-scaling
+        self._scaleV_(32, False, True)
         self._packAllScalings_()
         self._packCMDS_()
         self._packRaster_()
@@ -911,8 +1686,204 @@ class XPLNEDSF:
                 y = round(y, 0)
             x = int(x) #for point-centric, the outer edges of the pixels lie on the boundary of dsf, and just cutting to int should be right
             y = int(y)
-            return self.Raster[0].data[x][y]   
+            return self.Raster[0].data[x][y]
+
+    def getVertexElevations(self, x, y, z = None, mode = 'nearest', raster = None): #gets Elevations for all points in lists or arrays x (lon), y (lat) at once; values of z different from -32768 are taken as they are; mode 'nearest' as getVertexElevation() or 'bilinear'; raster is window from getRasterWindow() used instead of first raster layer; returns numpy array with nan for points outside, without numpy list with None
+        if mode not in ('nearest', 'bilinear'):
+            self._log_.error("getVertexElevations: mode {} not supported, only nearest or bilinear!!!".format(mode))
+            return None
+        if "sim/west" not in self.Properties:
+            self._log_.error("Cannot get elevations as properties like sim/west not defined!!!")
+            return None
+        if raster is None:
+            if len(self.DefRasters) == 0 or len(self.Raster) == 0:
+                self._log_.error("getVertexElevations: dsf includes no raster, elevations returned are None")
+                return None
+            if self.DefRasters[0] != "elevation":
+                self._log_.warning("Warning: The first raster layer is not called elevation, but used to determine elevation!")
+        R = self.Raster[0] if raster is None else raster #transformation from lon/lat to pixels is computed only once for all points
+        west, east = int(self.Properties["sim/west"]), int(self.Properties["sim/east"])
+        south, north = int(self.Properties["sim/south"]), int(self.Properties["sim/north"])
+        postcentric = R.flags & 4 #when bit 4 is set, the center of the pixels lies on the dsf-boundaries
+        xend = R.x0 + len(R.data) #data could cover only a window of pixels from x0 to xend and y0 to yend (excluded)
+        yend = R.y0 + (len(R.data[0]) if len(R.data) else 0)
+        if NUMPYINSTALLED:
+            x = np.asarray(x, np.float64)
+            y = np.asarray(y, np.float64)
+            elevations = np.full(x.shape, np.nan)
+            inside = (west <= x) & (x <= east) & (south <= y) & (y <= north)
+            if z is not None: #vertices with own elevation are not taken from raster
+                z = np.asarray(z, np.float64)
+                own = np.trunc(z) != -32768
+                elevations[own] = z[own]
+                inside &= ~own
+            outside = ~inside & np.isnan(elevations)
+            if outside.any():
+                self._log_.error("Cannot get elevation for {} points as coordinates are not within boundaries!!!".format(int(outside.sum())))
+            if mode == 'nearest':
+                px = np.abs(x[inside] - west) * (R.width - 1) # -1 from widht required, because pixels cover also boundaries of dsf lon/lat grid
+                py = np.abs(y[inside] - south) * (R.height - 1)
+                if postcentric:
+                    px = np.round(px)
+                    py = np.round(py)
+                x0 = x1 = px.astype(np.int64)
+                y0 = y1 = py.astype(np.int64)
+            else:
+                if postcentric: #pixel centers at boundaries, so points at integer pixel coordinates
+                    px = (x[inside] - west) * (R.width - 1)
+                    py = (y[inside] - south) * (R.height - 1)
+                else: #pixel centers in the middle of pixels covering the tile
+                    px = (x[inside] - west) * R.width - 0.5
+                    py = (y[inside] - south) * R.height - 0.5
+                px = np.clip(px, 0, R.width - 1)
+                py = np.clip(py, 0, R.height - 1)
+                x0 = np.minimum(px.astype(np.int64), max(R.width - 2, 0))
+                y0 = np.minimum(py.astype(np.int64), max(R.height - 2, 0))
+                x1 = np.minimum(x0 + 1, R.width - 1)
+                y1 = np.minimum(y0 + 1, R.height - 1)
+            valid = (x0 >= R.x0) & (x1 < xend) & (y0 >= R.y0) & (y1 < yend)
+            if not valid.all():
+                self._log_.error("Cannot get elevation for {} points as they are not within raster window!!!".format(int((~valid).sum())))
+            points = np.flatnonzero(inside)[valid]
+            data = np.asarray(R.data, np.float64)
+            x0, x1, y0, y1 = x0[valid] - R.x0, x1[valid] - R.x0, y0[valid] - R.y0, y1[valid] - R.y0
+            if mode == 'nearest':
+                elevations[points] = data[x0, y0]
+                return elevations
+            fx = px[valid] - (x0 + R.x0)
+            fy = py[valid] - (y0 + R.y0)
+            elevations[points] = (data[x0, y0] * (1 - fx) + data[x1, y0] * fx) * (1 - fy) + (data[x0, y1] * (1 - fx) + data[x1, y1] * fx) * fy
+            return elevations
+        elevations = [] #without numpy the points are computed one by one, but with the same transformation
+        outside = 0
+        for i in range(len(x)):
+            if z is not None and int(z[i]) != -32768:
+                elevations.append(z[i])
+                continue
+            if not (west <= x[i] <= east and south <= y[i] <= north):
+                elevations.append(None)
+                outside += 1
+                continue
+            if mode == 'nearest':
+                px = abs(x[i] - west) * (R.width - 1)
+                py = abs(y[i] - south) * (R.height - 1)
+                if postcentric:
+                    px = round(px, 0)
+                    py = round(py, 0)
+                x0 = x1 = int(px)
+                y0 = y1 = int(py)
+            else:
+                if postcentric:
+                    px = (x[i] - west) * (R.width - 1)
+                    py = (y[i] - south) * (R.height - 1)
+                else:
+                    px = (x[i] - west) * R.width - 0.5
+                    py = (y[i] - south) * R.height - 0.5
+                px = min(max(px, 0), R.width - 1)
+                py = min(max(py, 0), R.height - 1)
+                x0 = min(int(px), max(R.width - 2, 0))
+                y0 = min(int(py), max(R.height - 2, 0))
+                x1 = min(x0 + 1, R.width - 1)
+                y1 = min(y0 + 1, R.height - 1)
+            if not (x0 >= R.x0 and x1 < xend and y0 >= R.y0 and y1 < yend):
+                elevations.append(None)
+                outside += 1
+                continue
+            fx = px - x0
+            fy = py - y0
+            x0, x1, y0, y1 = x0 - R.x0, x1 - R.x0, y0 - R.y0, y1 - R.y0
+            if mode == 'nearest':
+                elevations.append(R.data[x0][y0])
+            else:
+                elevations.append((R.data[x0][y0] * (1 - fx) + R.data[x1][y0] * fx) * (1 - fy) + (R.data[x0][y1] * (1 - fx) + R.data[x1][y1] * fx) * fy)
+        if outside:
+            self._log_.error("Cannot get elevation for {} points as coordinates are not within boundaries or raster window!!!".format(outside))
+        return elevations
+
+    def getRasterWindow(self, west, east, south, north, layer = 0, margin = 1): #returns XPLNEraster with data only for the pixels covering lon/lat window plus margin pixels; if raster is not yet unpacked in lazy mode, only these pixels are decoded from atom
+        if "sim/west" not in self.Properties:
+            self._log_.error("Cannot get raster window as properties like sim/west not defined!!!")
+            return None
+        with self._lock_: #raster could be unpacked in parallel thread
+            if 'raster' in self._pendingStages_:
+                if layer >= len(self._Atoms_['IMED']) or len(self._Atoms_['IMED']) != len(self._Atoms_['DMED']):
+                    self._log_.error("Raster layer {} not defined for raster window!!!".format(layer))
+                    return None
+                R = XPLNEraster()
+                R.ver, R.bpp, R.flags, R.width, R.height, R.scale, R.offset = unpack('<BBHLLff', self._Atoms_['IMED'][layer])
+                atom = self._Atoms_['DMED'][layer]
+            else:
+                if layer >= len(self.Raster):
+                    self._log_.error("Raster layer {} not defined for raster window!!!".format(layer))
+                    return None
+                R = copy(self.Raster[layer])
+                R._pyramid_ = {}
+                atom = None
+        tilewest, tilesouth = int(self.Properties["sim/west"]), int(self.Properties["sim/south"])
+        pixels = [] #first and last pixel in x and y, for both centricities and all modes of getVertexElevations()
+        for lower, upper, start, size in ((west, east, tilewest, R.width), (south, north, tilesouth, R.height)):
+            first = min((lower - start) * (size - 1), (lower - start) * size - 0.5)
+            last = max((upper - start) * (size - 1), (upper - start) * size - 0.5)
+            pixels.append(max(int(first) - margin, 0))
+            pixels.append(min(int(last) + 1 + margin, size - 1))
+        R.x0, xend, R.y0, yend = pixels[0], pixels[1] + 1, pixels[2], pixels[3] + 1
+        if xend <= R.x0 or yend <= R.y0: #window is not covering the raster
+            R.data = []
+            return R
+        if atom is None:
+            if NUMPYINSTALLED and not isinstance(R.data, list):
+                R.data = R.data[R.x0 : xend, R.y0 : yend]
+            else:
+                R.data = [line[R.y0 : yend] for line in R.data[R.x0 : xend]]
+            return R
+        ctype = self._RasterTypes_.get(((R.flags & 1) or (R.flags & 2), R.bpp)) #signed integers if first bit is set, like in _extractRaster_()
+        if ctype is None:
+            self._log_.error("Not allowed bytes per pixel in Raster Definition!!!")
+            return None
+        if len(atom) < R.bpp * R.width * yend:
+            self._log_.error("Raster data atom number {} is shorter than defined by width {} and height {}!!!".format(layer, R.width, R.height))
+            return None
+        if NUMPYINSTALLED: #only rows of the window are read and only the pixels of the window are scaled
+            values = np.frombuffer(atom, np.dtype(ctype), (yend - R.y0) * R.width, R.y0 * R.width * R.bpp).reshape(yend - R.y0, R.width)[:, R.x0 : xend]
+            R.data = (values * np.float64(R.scale) + np.float64(R.offset)).T
+            return R
+        R.data = []
+        for x in range(R.x0, xend):
+            line = []
+            for y in range(R.y0, yend):
+                v, = unpack(ctype, atom[(y * R.width + x) * R.bpp : (y * R.width + x + 1) * R.bpp])
+                line.append(v * R.scale + R.offset)
+            R.data.append(line)
+        return R
 
+    def getRasterLevel(self, layer = 0, level = None, resolution = None, method = 'mean'): #returns data of raster layer for level of pyramid (see XPLNEraster.pyramid()) or for highest level with at least resolution pixels in x and y; if read with cache, levels are stored there and taken from it later without decoding raster
+        if method not in ('mean', 'min', 'max'):
+            self._log_.error("Method {} for raster pyramid not supported, only mean, min or max!!!".format(method))
+            return None
+        with self._lock_: #raster could be unpacked in parallel thread
+            if 'raster' in self._pendingStages_: #info of raster is taken from atom, so that raster has not to be decoded for levels in cache
+                if layer >= len(self._Atoms_['IMED']):
+                    self._log_.error("Raster layer {} not defined for raster pyramid!!!".format(layer))
+                    return None
+                R = XPLNEraster()
+                R.ver, R.bpp, R.flags, R.width, R.height, R.scale, R.offset = unpack('<BBHLLff', self._Atoms_['IMED'][layer])
+            elif layer < len(self.Raster):
+                R = self.Raster[layer]
+            else:
+                self._log_.error("Raster layer {} not defined for raster pyramid!!!".format(layer))
+                return None
+        if level is None:
+            level = R.level(resolution) if resolution is not None else 0
+        if level == 0:
+            return self.Raster[layer].data
+        if self._cacheKey_ is not None and NUMPYINSTALLED:
+            levels = self._cache_.loadPyramid(self._cacheKey_, layer, method) #levels from 1 on
+            if levels:
+                return levels[min(level, len(levels)) - 1]
+        levels = self.Raster[layer].pyramid(method)
+        if self._cacheKey_ is not None and NUMPYINSTALLED and len(levels) > 1:
+            self._cache_.storePyramid(self._cacheKey_, layer, method, levels[1:])
+        return levels[min(level, len(levels) - 1)]
 
     def getPolys(self, type): #returns all polygons of one type (numbered as in DefPolys) in a list and for each poly parameter following all vertices as reference [poolId, index]
         l = [] #list of polygons to be returned
@@ -981,68 +1952,202 @@ class XPLNEDSF:
                     yield(c)
         
                     
-    def read(self, file):  
-        self.__init__("_keep_logger_","_keep_statusfunction_") #make sure all values are initialized again in case additional read
-        if not path.isfile(file):
+    def getTriangleTable(self): #returns XPLNEtriangles with all triangles of all patches, expanded vectorized from the patch commands; requires numpy
+        if not NUMPYINSTALLED:
+            self._log_.error("getTriangleTable: numpy is required for the triangle table!")
+            return None
+        T = XPLNEtriangles()
+        triangles = [p.triangleArrays() for p in self.Patches]
+        counts = [len(t[0]) for t in triangles]
+        T.pools = np.concatenate([t[0] for t in triangles]) if triangles else np.empty((0, 3), np.int64)
+        T.vertices = np.concatenate([t[1] for t in triangles]) if triangles else np.empty((0, 3), np.int64)
+        T.patch = np.repeat(np.arange(len(self.Patches)), counts)
+        T.defIndex = np.repeat(np.array([p.defIndex for p in self.Patches], np.int64), counts)
+        T.flag = np.repeat(np.array([p.flag for p in self.Patches], np.int64), counts)
+        T.near = np.repeat(np.array([p.near for p in self.Patches], np.float64), counts)
+        T.far = np.repeat(np.array([p.far for p in self.Patches], np.float64), counts)
+        self._log_.info("Triangle table with {} triangles of {} patches built.".format(len(T), len(self.Patches)))
+        return T
+
+    def iterCommands(self): #yields the commands as stored in file (SDMC atom) one by one as list with id followed by values, without storing them; also in lazy mode without extracting patches etc.
+        return self._iterCMDS_()
+
+    def iterTriangles(self, batchsize = 65536): #yields XPLNEtriangles with up to batchsize triangles directly from the commands stored in file, so neither patches nor earlier batches are kept; patch is number of patch in file; requires numpy
+        if not NUMPYINSTALLED:
+            self._log_.error("iterTriangles: numpy is required for batches of triangles!")
+            return
+        columns = {name : [] for name in ('pools', 'vertices', 'patch', 'defIndex', 'flag', 'near', 'far')} #arrays of triangles not yet yielded
+        n = 0 #number of triangles not yet yielded
+        patch = -1
+        poolIndex = 0
+        defIndex = 0
+        flag_physical = 0
+        nearLOD = 0.0
+        farLOD = 0.0
+        for c in self._iterCMDS_():
+            if c[0] == 1: # new pool selection
+                poolIndex = c[1]
+            elif 3 <= c[0] <= 5: # new definition index
+                defIndex = c[1]
+            elif 16 <= c[0] <= 18: # new terrain patch
+                patch += 1
+                if c[0] == 17:
+                    flag_physical = c[1]
+                elif c[0] == 18:
+                    flag_physical, nearLOD, farLOD = c[1:4]
+            elif 23 <= c[0] <= 31: # patch command expanded like commands of a patch with just this command
+                p = XPLNEpatch(flag_physical, nearLOD, farLOD, poolIndex, defIndex)
+                p.cmds = [[1, poolIndex], c]
+                pools, vertices = p.triangleArrays()
+                for name, values in (('pools', pools), ('vertices', vertices), ('patch', np.full(len(pools), patch)), ('defIndex', np.full(len(pools), defIndex)),
+                                     ('flag', np.full(len(pools), flag_physical)), ('near', np.full(len(pools), nearLOD, np.float64)), ('far', np.full(len(pools), farLOD, np.float64))):
+                    columns[name].append(values)
+                n += len(pools)
+                while n >= batchsize:
+                    T = XPLNEtriangles()
+                    for name in columns:
+                        values = np.concatenate(columns[name])
+                        setattr(T, name, values[:batchsize])
+                        columns[name] = [values[batchsize:]]
+                    n -= batchsize
+                    yield T
+        if n:
+            T = XPLNEtriangles()
+            for name in columns:
+                setattr(T, name, np.concatenate(columns[name]))
+            yield T
+
+    def getTriangleGrid(self, cells = 64): #returns XPLNEtriangleGrid indexing all triangles of getTriangleTable() in cells x cells grid over the tile, to find triangles in areas; requires numpy
+        if "sim/west" not in self.Properties:
+            self._log_.error("Cannot build triangle grid as properties like sim/west not defined!!!")
+            return None
+        T = self.getTriangleTable()
+        if T is None:
+            return None
+        lon = np.empty(T.pools.shape)
+        lat = np.empty(T.pools.shape)
+        for p in np.unique(T.pools):
+            P = self.V[p].array if isinstance(self.V[p], XPLNEpool) else np.array([v[:2] for v in self.V[p]], np.float64)
+            inpool = T.pools == p
+            lon[inpool] = P[T.vertices[inpool], 0]
+            lat[inpool] = P[T.vertices[inpool], 1]
+        return XPLNEtriangleGrid(T, lon, lat, int(self.Properties["sim/west"]), int(self.Properties["sim/east"]), int(self.Properties["sim/south"]), int(self.Properties["sim/north"]), cells)
+
+    def read(self, file, usemmap = False, lazy = False, cache = None, member = None, verify = False, parallel = 0, deferscaling = False, floattype = 'float64', keepcmds = False, extract = None, rasters = None): #usemmap True maps file to memory and atoms are just memoryviews on it (no copies of atoms); lazy True unpacks raster, pools and commands only with first access; cache is DSFcache for decompressed 7z files and pyramids of raster layers
+        ### file can be a path, a bytes-like object with the dsf data or an opened seekable binary file; member is name of dsf file in case file is zip or 7z archive
+        ### with usemmap the memory map is closed as soon as all atoms are unpacked; in lazy mode the file stays mapped until then
+        ### verify True checks md5 hash value of file while reading and returns 5 without unpacking atoms in case of mismatch
+        ### parallel > 0 is the number of processes used to unpack raster layers, pools and commands at the same time (ignored in lazy mode)
+        ### deferscaling True keeps values of pools as read and scales them with first access (requires numpy); floattype 'float32' for scaled values saves memory
+        ### keepcmds True stores also all decoded commands in CMDS (for debugging), otherwise patches, polygons, objects and networks are extracted directly while decoding
+        ### extract selects content to be extracted from commands, e.g. ('patches',) of 'patches', 'objects', 'polygons' and 'networks'; commands of others are skipped, 32-bit pools are without networks only unpacked with first access
+        ### rasters selects names of raster layers in DefRasters to be decoded, e.g. ('elevation',); others keep only their info; files read with selected content can not be written again
+        self._resetData_() #make sure all values are initialized again in case additional read
+        self._deferScaling_ = deferscaling
+        self._floatType_ = floattype
+        self._keepCMDS_ = keepcmds
+        if extract is not None:
+            for content in extract:
+                if content not in self._ContentCMDS_:
+                    self._log_.warning("Content {} to be extracted unknown, only {} can be selected.".format(content, list(self._ContentCMDS_)))
+            self._extract_ = set(extract)
+        if rasters is not None:
+            self._rasters_ = set(rasters)
+        if isinstance(file, str) and not path.isfile(file):
             self._log_.error("File does not exist!".format(file))
             return 1
-        flength = stat(file).st_size #length of dsf-file   
-        self._progress_ = [0, 0, flength] #initilize progress start for reading
-        with open(file, "rb") as f:    ##Open Tile as binary fily for reading
-            self._log_.info("Opened file {} with {} bytes.".format(file, flength))
-            start = f.read(12)
-            if start.startswith(b'7z\xBC\xAF\x27\x1C'):
-                if PY7ZLIBINSTALLED:
-                    f.seek(0)
-                    archive = py7zlib.Archive7z(f)
-                    filedata = archive.getmember(archive.getnames()[0]).read()
-                    self._log_.info("File is 7Zip archive. Extracted and read file {} from archive with decompressed length {}.".format(archive.getnames()[0], len(filedata)))
-                    f.close()
-                    f = BytesIO(filedata)
-                    self._progress_ = [0, 0, len(filedata)] #set progress maximum to decompressed length
-                    flength = len(filedata) #also update to decompressed length
-                    start = f.read(12)
-                else:
-                    self._log_.error("File is 7Zip encoded! py7zlib not installed to decode.")
-                    return 2
-            identifier, version = unpack('<8sI',start)
-            if identifier.decode("utf-8") != "XPLNEDSF" or version != 1:
-                self._log_.error("File is no X-Plane dsf-file Version 1 !!!")  
-                return 3            
-            while f.tell() < flength - 16: #read chunks until reaching last 16 bytes hash value
-                bytes = f.read(8)
-                atomID, atomLength = unpack('<4sI',bytes)        
-                atomID = atomID.decode("utf-8")
-                if atomID in self._AtomStructure_.keys():
-                    if self._DEBUG_: self._log_.debug("Reading top-level atom {} with length of {} bytes.".format(atomID, atomLength))
-                else:
-                    if self._DEBUG_: self._log_.debug("Reading atom {} with length of {} bytes.".format(atomID, atomLength))
-                if atomID in self._AtomOfAtoms_:  
-                    self._Atoms_[atomID] = [] #just keep notice in dictonary that atom of atoms was read
-                elif atomID in self._AtomList_:
-                    bytes = f.read(atomLength-8)   ##Length includes 8 bytes header
-                    if atomID in self._Atoms_: #subatom already exists in dictionary
-                        self._Atoms_[atomID].append(bytes) #append string to existing list
+        buffer = None #memoryview of whole file in case file is mapped to memory
+        with _openSource_(file) as fraw:    ##Open Tile as binary fily for reading
+            error, f, flength, extracted = _openDSF_(fraw, cache, member) #f is temporary or cached file with decompressed data for archives
+            if error:
+                self._log_.error(f)
+                return -error #same error codes as before: 2 for 7z not decoded, 3 for no dsf file
+            if cache is not None and isinstance(file, str):
+                self._cache_ = cache
+                self._cacheKey_ = cache.keyOf(f) or cache.key(file, None, member) #same key as decompressed dsf file of 7z archive, so that both are kept together; without crc for files that are not archives
+            self._progress_ = [0, 0, flength] #initilize progress start for reading
+            self._log_.info("Opened file {} with {} bytes.".format(file if isinstance(file, str) else type(file).__name__, flength))
+            if extracted is not None:
+                self._log_.info("File is archive. Read decompressed file {} with length {}.".format(extracted, flength))
+            if isinstance(f, _BufferFile_): #data is already in memory, so atoms are always views on it
+                buffer = f.view
+            elif usemmap:
+                try:
+                    self._mmap_ = mmap(f.fileno(), 0, access=ACCESS_READ) #map stays valid after file is closed
+                    buffer = memoryview(self._mmap_)
+                    self._log_.info("File mapped to memory.")
+                except (OSError, ValueError, UnsupportedOperation): #e.g. streams without file descriptor
+                    self._log_.info("File can not be mapped to memory, atoms will be read.")
+            try: #for archives also the temporary file is closed at the end
+                error, toc = scanDSFatoms(f, flength) #only atom headers are read, bodies are read below by seeking to them
+                if error:
+                    self._log_.error(toc)
+                    return 4
+                m = None #md5 hash over all data read in verify mode
+                if verify:
+                    if buffer is not None: #data is already in memory, so just hash it in one go
+                        m = md5(buffer[:flength - 16])
+                    else: #hash while reading atoms, these are read in order of file
+                        f.seek(0)
+                        m = md5(f.read(12))
+                for atomID, offset, atomLength, level in toc:
+                    if m is not None and buffer is None: #read whole atom including header, so that also unknown atoms are hashed
+                        if level == 0 and atomID in _DSFATOMSOFATOMS:
+                            f.seek(offset)
+                            m.update(f.read(8)) #only header, the sub-atoms follow with own entries
+                        else:
+                            f.seek(offset)
+                            data = f.read(atomLength)
+                            m.update(data)
+                            data = memoryview(data) #atom below is then view on the data without copying it
+                    if level == 0:
+                        if self._DEBUG_: self._log_.debug("Reading top-level atom {} with length of {} bytes.".format(atomID, atomLength))
                     else:
-                        if atomID in self._MultiAtoms_:
-                            self._Atoms_[atomID] = [bytes] #create new list entry, as for multiple atoms more can follow to be appended
+                        if self._DEBUG_: self._log_.debug("Reading atom {} with length of {} bytes.".format(atomID, atomLength))
+                    if atomID in self._AtomOfAtoms_:  
+                        self._Atoms_[atomID] = [] #just keep notice in dictonary that atom of atoms was read
+                    elif atomID in self._AtomList_:
+                        if buffer is not None: #no copy of atom, just view on mapped memory
+                            bytes = buffer[offset + 8 : offset + atomLength]
+                        elif m is not None: #atom already read for hashing
+                            bytes = data[8:]
                         else:
-                            self._Atoms_[atomID] = bytes #for single atoms there is just this string
-                else:
-                    self._log_.warning("Jumping over unknown Atom ID (reversed): {} with length {}!!".format(atomID, atomLength))
-                    bytes = f.read(atomLength-8)
-                    #return 4
-            self.FileHash = f.read(16)
-            if self._DEBUG_: self._log_.debug("Reached FOOTER with Hash-Value: {}".format(self.FileHash))
+                            f.seek(offset + 8)
+                            bytes = f.read(atomLength-8)   ##Length includes 8 bytes header
+                        if atomID in self._Atoms_: #subatom already exists in dictionary
+                            self._Atoms_[atomID].append(bytes) #append string to existing list
+                        else:
+                            if atomID in self._MultiAtoms_:
+                                self._Atoms_[atomID] = [bytes] #create new list entry, as for multiple atoms more can follow to be appended
+                            else:
+                                self._Atoms_[atomID] = bytes #for single atoms there is just this string
+                    else:
+                        self._log_.warning("Jumping over unknown Atom ID (reversed): {} with length {}!!".format(atomID, atomLength))
+                f.seek(flength - 16)
+                self.FileHash = f.read(16)
+                if self._DEBUG_: self._log_.debug("Reached FOOTER with Hash-Value: {}".format(self.FileHash))
+            finally:
+                if f is not fraw:
+                    f.close()
         self._log_.info("Finished pure file reading.")
-        self._unpackAtoms_()
+        if m is not None:
+            self.FileHashValid = (m.digest() == self.FileHash)
+            if not self.FileHashValid:
+                self._log_.error("File is corrupt, md5 hash value {} does not match the one in file {}!".format(m.hexdigest(), self.FileHash.hex()))
+                return 5
+            self._log_.info("Hash value of file verified.")
+        buffer = bytes = data = None #views on memory map are only kept in atoms, so that map can be closed when all atoms are unpacked
+        self._unpackAtoms_(lazy, parallel)
         return 0 #file successfull read
 
     
-    def write(self, file): #writes data to dsf file with according file-name
+    def write(self, file, optimize = None): #writes data to dsf file with according file-name; optimize 'morton' or 'firstuse' reorders vertices in pools for better compression and locality
+        if self._extract_ is not None or self._rasters_ is not None:
+            self._log_.error("DSF read with selected content can not be written, as content not selected would be lost!")
+            return 1
         self._progress_[0] = 0
         self._progress_[1] = 0 #keep original file length as goal to reach in progress[2]
-        self._packAtoms_() #first write values of Atom strings that below will written to file   
+        self._packAtoms_(optimize) #first write values of Atom strings that below will written to file   
         m = md5() #m will at the end contain the new md5 checksum of all data in file
         with open(file, "w+b") as f:    ##Open Tile as binary fily for writing and allow overwriting of existing file
             self._log_.info("Write now DSF in file: {}".format(file)  )
@@ -1058,19 +2163,23 @@ class XPLNEDSF:
                 elif k in self._MultiAtoms_:
                     for a in self._Atoms_[k]:
                         if self._DEBUG_: self._log_.debug("Writing multi atom {} with length {} bytes.".format(k, len(a) + 8))
-                        s = pack('<4sI', k.encode("utf-8"), len(a) + 8) + a # add 8 for atom header length (id+length)
-                        m.update(s)
+                        s = pack('<4sI', k.encode("utf-8"), len(a) + 8) # add 8 for atom header length (id+length)
+                        m.update(s) #header and atom are hashed and written separately, so atom is not copied
+                        m.update(a)
                         f.write(s)
-                        self._updateProgress_(len(s))
+                        f.write(a)
+                        self._updateProgress_(len(a) + 8)
                 else: #just single instance atom with plane data
                         if k in self._AtomStructure_.keys():
                             if self._DEBUG_: self._log_.debug("Writing top-level atom {} with length {} bytes.".format(k, len(self._Atoms_[k]) + 8))
                         else:
                             if self._DEBUG_: self._log_.debug("Writing single atom {} with length {} bytes.".format(k, len(self._Atoms_[k]) + 8))
-                        s = pack('<4sI', k.encode("utf-8"), len(self._Atoms_[k]) + 8) + self._Atoms_[k] # add 8 for atom header length (id+length)
+                        s = pack('<4sI', k.encode("utf-8"), len(self._Atoms_[k]) + 8) # add 8 for atom header length (id+length)
                         m.update(s)
-                        f.write(s) 
-                        self._updateProgress_(len(s))
+                        m.update(self._Atoms_[k])
+                        f.write(s)
+                        f.write(self._Atoms_[k])
+                        self._updateProgress_(len(self._Atoms_[k]) + 8)
             if self._DEBUG_: self._log_.debug("New md5 value appended to file is: {}".format(m.digest()))
             f.write(m.digest())
         self._log_.info("Finished writing dsf-file.")
@@ -1117,51 +2226,751 @@ def isDSFoverlay(file):
                     return False
     return "ERROR in isDSFoverlay: File {} does not have an HEADER atom; no vaild dsf file!".format(file)
 """
-                    
-def getDSFproperties(file):
+
+def _unpackTask_(logname, loglevel, atomshm, resultshm, task):
+    """
+    Unpacks one raster layer, one pool or the commands in a worker process started by XPLNEDSF._unpackParallel_().
+    The atoms are read from shared memory atomshm; raster data and pool values are written as doubles to
+    shared memory resultshm, so that they have not to be pickled. Scalings, raster info and commands are returned.
+    """
+    global _WORKERDSF
+    stage, index, atoms, offset, shape, defs = task
+    if _WORKERDSF is None: #one instance per worker process
+        _WORKERDSF = XPLNEDSF(logname, None)
+    dsf = _WORKERDSF
+    dsf._log_.setLevel(loglevel)
+    dsf._resetData_()
+    for name, value in defs.items():
+        setattr(dsf, name, value)
+    shm = SharedMemory(name=atomshm)
+    try:
+        for k, a in atoms.items():
+            if isinstance(a, list):
+                dsf._Atoms_[k] = [shm.buf[o : o + l] for o, l in a]
+            else:
+                dsf._Atoms_[k] = shm.buf[a[0] : a[0] + a[1]]
+        if stage == 'cmds':
+            if dsf._keepCMDS_:
+                dsf._unpackCMDS_()
+            error = dsf._extractCMDS_()
+            return error, {name : getattr(dsf, name) for name in dsf._StageAttributes_[stage]}
+        if stage == 'raster':
+            error = dsf._extractRaster_()
+            if error or not dsf.Raster:
+                return error or 1, None
+            R = dsf.Raster[0]
+            if NUMPYINSTALLED:
+                values = np.ascontiguousarray(R.data, np.float64)
+            else:
+                values = array('d', chain.from_iterable(R.data))
+            R.data = []
+        else:
+            bit = 16 if stage == 'pools16' else 32
+            dsf._extractPools_(bit)
+            dsf._extractScalings_(bit)
+            dsf._scaleV_(bit, False) #False that scaling is not reversed
+            V, Scalings = (dsf.V, dsf.Scalings) if bit == 16 else (dsf.V32, dsf.Scal32)
+            nArrays, nPlanes = shape
+            if isinstance(V[0], XPLNEpool): #values are copied as they are, dtype is returned; with deferred scaling the raw values
+                if V[0].shape != (nArrays, nPlanes):
+                    return V[0], Scalings[0], [], None
+                values = np.ascontiguousarray(V[0].array if V[0].raw is None else V[0].raw)
+                intplanes = values.dtype.str
+            else:
+                if len(V[0]) != nArrays or any(len(v) != nPlanes for v in V[0]): #pool could not be unpacked completely, so return it as it is
+                    return V[0], Scalings[0], [], None
+                intplanes = [n for n in range(nPlanes) if nArrays and isinstance(V[0][0][n], int)]
+                values = array('d', chain.from_iterable(V[0]))
+        if len(values):
+            result = SharedMemory(name=resultshm)
+            try:
+                with memoryview(values) as data, data.cast('B') as b:
+                    result.buf[offset : offset + len(b)] = b
+            finally:
+                result.close()
+        if stage == 'raster':
+            return 0, R
+        if isinstance(intplanes, str):
+            return None, Scalings[0], [], intplanes
+        return None, Scalings[0], intplanes, None
+    finally:
+        dsf._resetData_() #releases all views on shared memory before closing it
+        shm.close()
+
+
+def scanDSFatoms(f, flength, start = 12, stop = None):
+    """
+    This function builds the table of contents of the dsf data in the opened binary file f with length flength.
+    Only the 8 byte atom headers are read, the atom bodies are just skipped by seek.
+    It returns error code and the table of contents or error-string in case error != 0.
+    The table of contents is a list with a tuple (atomID, offset, length, level) for every atom in file order, including
+    each instance of repeated atoms like LOOP, IMED or DMED. Offset is the position of the atom header, length includes
+    the 8 header bytes and level is 0 for top-level atoms and 1 for sub-atoms inside an atom of atoms.
+    If stop is the ID of a top-level atom, e.g. "DAEH", scanning ends after this atom and its sub-atoms.
+    """
+    toc = []
+    end = flength - 16  # last 16 bytes are md5 hash value
+    parentEnd = 0  # end of atom of atoms which sub-atoms are currently scanned
+    pos = start  # position of next atom header, first one directly after file header
+    stopEnd = end  # end of atom stop, if already found
+    while pos < stopEnd:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return -5, "ERROR in scanDSFatoms: Unexpected end of file at position {}!".format(pos)
+        atomID, atomLength = unpack('<4sI', header)
+        atomID = atomID.decode("utf-8", errors="replace")
+        if atomLength < 8 or pos + atomLength > end:
+            return -5, "ERROR in scanDSFatoms: Atom {} at position {} has invalid length {}!".format(atomID, pos, atomLength)
+        level = 1 if pos < parentEnd else 0
+        toc.append((atomID, pos, atomLength, level))
+        if level == 0 and atomID == stop:
+            stopEnd = pos + atomLength
+        if level == 0 and atomID in _DSFATOMSOFATOMS:
+            parentEnd = pos + atomLength
+            pos += 8  # continue with first sub-atom
+        else:
+            pos += atomLength
+    return 0, toc
+
+
+def getDSFatomTOC(file, cache = None, member = None):
+    """
+    This function returns error code and the table of contents of a dsf file (see scanDSFatoms) or error-string in case error != 0.
+    File can also be bytes-like or an opened binary file. For zip or 7z archives member is the name of the dsf file to use.
+    For 7z compressed files the decompressed file is taken from or stored in the DSFcache cache, if given.
+    """
+    if isinstance(file, str) and not path.isfile(file):
+        return -1, "ERROR in getDSFatomTOC: File {} does not exist!".format(file)
+    with _openSource_(file) as fraw:  # Open Tile as binary file for reading
+        error, f, flength, extracted = _openDSF_(fraw, cache, member)  # f is temporary or cached file with decompressed data for archives
+        if error:
+            return error, "ERROR in getDSFatomTOC: File {}: {}".format(file, f)
+        try:
+            return scanDSFatoms(f, flength)
+        finally:
+            if f is not fraw:
+                f.close()
+
+
+def getDSFproperties(file, cache = None, member = None):
     """
     This function returns error code and the properties of a dsf file as dict or error-string in case error != 0.
+    File can also be bytes-like or an opened binary file. For zip or 7z archives member is the name of the dsf file to use.
+    For 7z compressed files the decompressed file is taken from or stored in the DSFcache cache, if given.
     """
-    if not path.isfile(file):
+    if isinstance(file, str) and not path.isfile(file):
         return -1, "ERROR in getDSFproperties: File {} does not exist!".format(file)
-    flength = stat(file).st_size  # length of dsf-file
-    with open(file, "rb") as f:  # Open Tile as binary file for reading
-        start = f.read(12)
-        if start.startswith(b'7z\xBC\xAF\x27\x1C'):
-            if PY7ZLIBINSTALLED:
+    with _openSource_(file) as fraw:  # Open Tile as binary file for reading
+        error, f, flength, extracted = _openDSF_(fraw, cache, member)  # f is temporary or cached file with decompressed data for archives
+        if error:
+            return error, "ERROR in getDSFproperties: File {}: {}".format(file, f)
+        try:
+            error, toc = scanDSFatoms(f, flength, stop="DAEH")  # only headers up to end of header atom are read, so just PROP atom body is read below
+            if error:
+                return error, toc
+            inHeader = False  # Flag when inside Header atom of atoms
+            props_dict = dict()  # dictionary with properties to be returned
+            for atomID, offset, atomLength, level in toc:
+                if level == 0:
+                    inHeader = (atomID == "DAEH")
+                elif inHeader and atomID == "PORP":
+                    f.seek(offset + 8)
+                    bytes = f.read(atomLength-8)
+                    x=bytes.split(b'\x00')
+                    for i in range(0, len(x)-1, 2):
+                        props_dict[x[i].decode("utf-8")]=x[i+1].decode("utf-8")
+                    return 0, props_dict  # 0 for no error
+        finally:
+            if f is not fraw:
+                f.close()
+    return -4, "ERROR in getDSFproperties: File {} does not have an HEADER/PROPERTIES atom; no vaild dsf file!".format(file)
+
+
+def _estimateDSFsize_(file, member = None):
+    """
+    This function returns the size of the dsf data in file without decompressing it, for zip or 7z archives the
+    size of the member (default first dsf file) when decompressed. In case of errors the size of the file is returned.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return len(file)
+    try:
+        with _openSource_(file) as f:
+            start = f.read(6)
+            if start.startswith(_7ZSIGNATURE):
+                files = [[name, size] for name, size, crc, folder, offset in DSF7zArchive(f).files]
+            elif start.startswith(b'PK'):
+                files = [[i.filename, i.file_size] for i in ZipFile(f).infolist()]
+            else:
+                f.seek(0, 2)
+                return f.tell()
+            if member is None:
+                files = [x for x in files if x[0].lower().endswith(".dsf")] + files
+                return files[0][1]
+            return [size for name, size in files if name == member][0]
+    except Exception:
+        return stat(file).st_size if isinstance(file, str) and path.isfile(file) else 0
+
+
+def _readTask_(logname, loglevel, file, options):
+    """
+    Reads a dsf file in a worker process started by readDSFbatch() and returns error code and the XPLNEDSF instance.
+    """
+    dsf = XPLNEDSF(logname, None)
+    dsf._log_.setLevel(loglevel)
+    return dsf.read(file, **options), dsf
+
+
+def readDSFbatch(files, workers = None, maxmemory = None, logname = '__XPLNEDSF__', **options):
+    """
+    This generator reads the dsf files in list files in a pool of worker processes and yields for each file a tuple
+    (file, error code, XPLNEDSF instance or error-string in case error != 0) as soon as it is read, so not necessarily
+    in the order of files. Errors of single files do not stop reading the others. Error codes are the ones of
+    XPLNEDSF.read() and 6 if the worker process failed. workers is the maximum number of processes (default number
+    of cpus). maxmemory limits the estimated memory in bytes of all files read at the same time, at least one file is
+    always read. Further options like cache, member or verify are passed to XPLNEDSF.read().
+    """
+    if logname == '__XPLNEDSF__':
+        loglevel = getLogger('XPLNEDSF').getEffectiveLevel()
+    else:
+        loglevel = getLogger(logname + '.' + __name__).getEffectiveLevel()
+    files = list(files)
+    memory = 0 #estimated memory of all files read at the moment
+    running = {} #futures of files read at the moment with file and estimated memory
+    executor = ProcessPoolExecutor(workers)
+    try:
+        i = 0 #index of next file to be read
+        while i < len(files) or running:
+            while i < len(files):
+                estimate = _estimateDSFsize_(files[i], options.get('member')) * _DSFMEMORYFACTOR
+                if running and maxmemory is not None and memory + estimate > maxmemory:
+                    break
+                running[executor.submit(_readTask_, logname, loglevel, files[i], options)] = (files[i], estimate)
+                memory += estimate
+                i += 1
+            done, notdone = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                file, estimate = running.pop(future)
+                memory -= estimate
+                try:
+                    error, dsf = future.result()
+                except Exception as err:
+                    yield file, 6, "ERROR in readDSFbatch: Reading file {} failed in worker process: {}".format(file, err)
+                else:
+                    if error:
+                        yield file, error, "ERROR in readDSFbatch: Reading file {} returned error {}!".format(file, error)
+                    else:
+                        yield file, 0, dsf
+    finally:
+        for future in running: #in case generator is not used until end
+            future.cancel()
+        executor.shutdown()
+
+
+@contextmanager
+def _openSource_(file):
+    """
+    This function opens the source of dsf data for reading, which can be a path, a bytes-like object or an already
+    opened seekable binary file. Files opened here are closed again, others are kept open.
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            yield f
+    elif isinstance(file, (bytes, bytearray, memoryview)):
+        yield _BufferFile_(file)
+    else:
+        file.seek(0)
+        yield file
+
+
+class _BufferFile_(RawIOBase): #Read-only file on a bytes-like object without copying it, so that atoms can be views on the data
+    def __init__(self, data):
+        self.view = memoryview(data).cast('B')
+        self.pos = 0
+    def readable(self):
+        return True
+    def seekable(self):
+        return True
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self.view) - self.pos))
+        b[:n] = self.view[self.pos : self.pos + n]
+        self.pos += n
+        return n
+    def seek(self, pos, whence = 0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.view)
+        self.pos = pos
+        return pos
+    def tell(self):
+        return self.pos
+
+
+def _openDSF_(f, cache = None, member = None):
+    """
+    This function checks that the opened binary file f contains dsf data and extracts it to a temporary file
+    in case it is a zip or 7z archive, where member is the name of the dsf file in the archive (default first one).
+    If a DSFcache is given, the decompressed data of 7z archives is taken from or stored to the cache.
+    It returns error code, the file object to read the dsf data from, the length of the dsf data and the name
+    of the extracted archive member or cached file (None if not compressed).
+    In case error != 0 an error-string is returned instead of the file object.
+    """
+    start = f.read(32)
+    extracted = None
+    if start.startswith(b'PK\x03\x04'):  # zip archive, e.g. scenery pack
+        try:
+            with ZipFile(f) as archive:
+                if member is None:
+                    member = [n for n in archive.namelist() if n.lower().endswith(".dsf")][0]
+                out = TemporaryFile()
+                with archive.open(member) as m:
+                    copyfileobj(m, out, 1048576)
+                out.seek(0)
+        except (BadZipFile, KeyError, IndexError) as e:
+            return -2, "Could not extract dsf file {} from zip archive: {}".format(member, e), 0, None
+        error, f, flength, inner = _openDSF_(out)  # dsf in zip might be 7z compressed as well
+        if f is not out:
+            out.close()
+        return error, f, flength, member
+    if start.startswith(_7ZSIGNATURE):
+        key = None  # key of decompressed file in cache
+        cached = None
+        if cache is not None and isinstance(getattr(f, 'name', None), str):
+            key = cache.key(f.name, unpack('<I', start[28:32])[0], member)  # crc of 7z header identifies content of archive
+            cached = cache.open(key)
+        if cached is not None:
+            extracted = cached.name
+            f = cached
+        else:
+            out = cache.create() if key is not None else TemporaryFile()
+            f.seek(0)
+            error, info = extract7z(f, member, out)
+            if error == -1 and PY7ZLIBINSTALLED:  # archive uses features not supported by DSF7zArchive, so try py7zlib
                 f.seek(0)
                 archive = py7zlib.Archive7z(f)
-                filedata = archive.getmember(archive.getnames()[0]).read()
-                f.close()
-                f = BytesIO(filedata)
-                flength = len(filedata)  # also update to decompressed length
-                start = f.read(12)
+                extracted = member if member is not None else archive.getnames()[0]
+                out.seek(0)
+                out.truncate()
+                out.write(archive.getmember(extracted).read())
+            elif error:
+                if key is not None:
+                    cache.discard(out)
+                else:
+                    out.close()
+                return -2, info, 0, None
             else:
-                return -2, "ERROR in getDSFproperties: File {} is 7Zip encoded! py7zlib not installed to decode.".format(file)
-        identifier, version = unpack('<8sI',start)
-        if identifier.decode("utf-8") != "XPLNEDSF" or version != 1:
-            return -3, "ERROR in getDSFproperties: File {} is no X-Plane dsf-file Version 1!".format(file)
-        inHeader = False  # Flag when inside Header atom of atoms
-        props_dict = dict()  # dictionary with properties to be returned
-        while f.tell() < flength - 16:  # read chunks until reaching last 16 bytes hash value
-            bytes = f.read(8)
-            atomID, atomLength = unpack('<4sI', bytes)
-            atomID = atomID.decode("utf-8")
-            if atomID == "DAEH":
-                inHeader = True
-            elif inHeader and atomID == "PORP":
-                bytes = f.read(atomLength-8)
-                x=bytes.split(b'\x00')
-                for i in range(0, len(x)-1, 2):
-                    props_dict[x[i].decode("utf-8")]=x[i+1].decode("utf-8")
-                return 0, props_dict  # 0 for no error
-                start = 0  # position when going through bytes
-                while bytes.find(b'\x00',start) >= 0:
-                    next = bytes.find(b'\x00',start)
-                    end = bytes.find(b'\x00',next+1)
-                    props_dict[bytes[start:next].decode("utf-8")] = bytes[next+1:end].decode("utf-8")
-                    start = end+1
-                return 0, props_dict  # 0 for no error
+                extracted = info[0]
+            if key is not None:
+                f = cache.commit(key, out)
             else:
-                bytes = f.read(atomLength-8)  # Continue reading, Length includes 8 bytes header
-    return -4, "ERROR in getDSFproperties: File {} does not have an HEADER/PROPERTIES atom; no vaild dsf file!".format(file)
+                f = out
+        f.seek(0)
+        start = f.read(12)
+    f.seek(0, 2)
+    flength = f.tell()
+    if len(start) < 12 or start[:8] != b'XPLNEDSF' or unpack('<I', start[8:12])[0] != 1:
+        if extracted is not None:
+            f.close()
+        return -3, "File is no X-Plane dsf-file Version 1!", 0, None
+    return 0, f, flength, extracted
+
+
+class DSFcache: #Directory storing decompressed dsf files of 7z archives and pyramids of raster layers; least recently used files are removed when exceeding maxsize bytes
+    def __init__(self, directory, maxsize = 4294967296):
+        self.directory = directory
+        self.maxsize = maxsize
+        makedirs(directory, exist_ok=True)
+
+    def key(self, file, archivecrc, member = None): #returns key for member of 7z file with path, size, modification time and crc of archive header
+        s = stat(file)
+        return sha1("{}|{}|{}|{}|{}".format(path.abspath(file), s.st_size, s.st_mtime_ns, archivecrc, member).encode("utf-8")).hexdigest()
+
+    def filename(self, key):
+        return path.join(self.directory, key + ".dsf")
+
+    def keyOf(self, f): #returns key of opened file f if it is a decompressed dsf file in cache, otherwise None
+        name = getattr(f, 'name', None)
+        if not isinstance(name, str) or not name.endswith(".dsf") or path.dirname(path.abspath(name)) != path.abspath(self.directory):
+            return None
+        return path.basename(name)[:-4]
+
+    def pyramidfile(self, key, layer, method):
+        return path.join(self.directory, "{}.{}.{}.npz".format(key, layer, method))
+
+    def loadPyramid(self, key, layer, method): #returns list of levels of raster pyramid stored for key or None if not cached; file is marked as recently used
+        try:
+            with np.load(self.pyramidfile(key, layer, method)) as levels:
+                levels = [levels["level{}".format(n)] for n in range(1, len(levels.files) + 1)]
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            utime(self.pyramidfile(key, layer, method))
+        except OSError:
+            pass
+        return levels
+
+    def storePyramid(self, key, layer, method, levels): #stores list of levels of raster pyramid from level 1 on for key
+        fd, name = mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with open(fd, "wb") as f:
+                np.savez(f, **{"level{}".format(n) : level for n, level in enumerate(levels, 1)})
+            replace(name, self.pyramidfile(key, layer, method)) #atomic, so other processes never see incomplete files
+        except OSError:
+            try:
+                remove(name)
+            except OSError:
+                pass
+            return
+        self._evict_(key)
+
+    def open(self, key): #returns opened cached file for key or None if not cached; file is marked as recently used
+        try:
+            f = open(self.filename(key), "rb")
+        except OSError:
+            return None
+        try:
+            utime(self.filename(key)) #modification time is used for order of least recent use
+        except OSError:
+            pass
+        return f
+
+    def create(self): #returns new file in cache directory to write decompressed data to; to be added with commit() or removed with discard()
+        fd, name = mkstemp(suffix=".tmp", dir=self.directory)
+        close(fd)
+        return open(name, "w+b")
+
+    def commit(self, key, f): #stores file f from create() under key and returns it opened for reading
+        f.close()
+        replace(f.name, self.filename(key)) #atomic, so other processes never see incomplete files
+        self._evict_(key)
+        return self.open(key)
+
+    def discard(self, f):
+        f.close()
+        try:
+            remove(f.name)
+        except OSError:
+            pass
+
+    def _evict_(self, keep = None): #removes least recently used files until size of cache is below maxsize; keep is key of file not to remove
+        entries = []
+        for name in listdir(self.directory):
+            if name.endswith(".dsf") or name.endswith(".npz"): #decompressed dsf files and raster pyramids
+                try:
+                    s = stat(path.join(self.directory, name))
+                except OSError: #removed by other process meanwhile
+                    continue
+                entries.append((s.st_mtime, s.st_size, name))
+        total = sum(e[1] for e in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.maxsize:
+                break
+            if keep is not None and name.startswith(keep): #dsf file or pyramids of keep
+                continue
+            try:
+                remove(path.join(self.directory, name))
+                total -= size
+            except OSError: #e.g. file still opened under Windows
+                pass
+
+
+_7ZSIGNATURE = b'7z\xBC\xAF\x27\x1C'
+if LZMAINSTALLED: #7z ids of branch converters (BCJ filters) with according filter of lzma module
+    _7ZBCJFILTERS = {b'\x03\x03\x01\x03' : lzma.FILTER_X86, b'\x03\x03\x02\x05' : lzma.FILTER_POWERPC, b'\x03\x03\x04\x01' : lzma.FILTER_IA64,
+                     b'\x03\x03\x05\x01' : lzma.FILTER_ARM, b'\x03\x03\x07\x01' : lzma.FILTER_ARMTHUMB, b'\x03\x03\x08\x05' : lzma.FILTER_SPARC}
+
+
+class _Bytes7z_: #Cursor over a 7z header with the 7z specific number encoding
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+    def byte(self):
+        self.pos += 1
+        return self.data[self.pos - 1]
+    def read(self, n):
+        self.pos += n
+        if self.pos > len(self.data):
+            raise ValueError("Unexpected end of 7z header")
+        return self.data[self.pos - n : self.pos]
+    def uint32(self):
+        return unpack('<I', self.read(4))[0]
+    def number(self): #7z UINT64: number of leading 1 bits in first byte gives number of following bytes
+        first = self.byte()
+        mask = 0x80
+        value = 0
+        for i in range(8):
+            if not first & mask:
+                return value | ((first & (mask - 1)) << (8 * i))
+            value |= self.byte() << (8 * i)
+            mask >>= 1
+        return value
+    def bits(self, n): #bit vector with n values, highest bit first
+        data = self.read((n + 7) // 8)
+        return [bool(data[i // 8] & (0x80 >> (i % 8))) for i in range(n)]
+    def digests(self, n): #list of n crc values, None for undefined ones
+        allDefined = self.byte()
+        defined = [True] * n if allDefined else self.bits(n)
+        return [self.uint32() if d else None for d in defined]
+
+
+class DSF7zArchive: #Reads 7z archives containing dsf files, decompressing with the lzma module of python (LZMA, LZMA2 or copy, one coder per folder)
+    def __init__(self, f):
+        self._f_ = f #opened binary file of archive
+        self.files = [] #for each file with data a list [name, size, crc, folder index, offset in unpacked folder]
+        f.seek(0)
+        start = f.read(32)
+        if len(start) < 32 or not start.startswith(_7ZSIGNATURE):
+            raise ValueError("File is no 7z archive")
+        nextOffset, nextSize, nextCRC = unpack('<QQI', start[12:32])
+        f.seek(32 + nextOffset)
+        header = f.read(nextSize)
+        if len(header) != nextSize or crc32(header) != nextCRC:
+            raise ValueError("7z header is corrupt (crc error)")
+        b = _Bytes7z_(header)
+        id = b.byte()
+        while id == 0x17: #kEncodedHeader: header itself is packed
+            streams = self._readStreamsInfo_(b)
+            out = BytesIO()
+            self._unpackFolder_(streams, 0, out, 0, streams['folders'][0]['size'], streams['folders'][0]['crc'])
+            b = _Bytes7z_(out.getvalue())
+            id = b.byte()
+        if id != 0x01: #kHeader
+            raise ValueError("7z header not found")
+        id = b.byte()
+        if id == 0x02: #kArchiveProperties are skipped
+            while b.byte():
+                b.read(b.number())
+            id = b.byte()
+        if id == 0x03: #kAdditionalStreamsInfo not used for dsf archives
+            self._readStreamsInfo_(b)
+            id = b.byte()
+        self._streams_ = {'folders' : [], 'substreams' : []}
+        if id == 0x04: #kMainStreamsInfo
+            self._streams_ = self._readStreamsInfo_(b)
+            id = b.byte()
+        names = []
+        emptyStream = []
+        if id == 0x05: #kFilesInfo
+            numFiles = b.number()
+            emptyStream = [False] * numFiles
+            while True:
+                property = b.number()
+                if property == 0: #kEnd
+                    break
+                size = b.number()
+                data = _Bytes7z_(b.read(size))
+                if property == 0x0E: #kEmptyStream
+                    emptyStream = data.bits(numFiles)
+                elif property == 0x11: #kName
+                    if data.byte(): #external names not supported
+                        raise NotImplementedError("External file names in 7z archive not supported")
+                    names = bytes(data.read(size - 1)).decode("utf-16-le").split('\x00')[:numFiles]
+            id = b.byte()
+        if id != 0x00:
+            raise ValueError("7z header has unexpected property {}".format(id))
+        substreams = iter(self._streams_['substreams'])
+        for i, name in enumerate(names):
+            if not emptyStream[i]:
+                self.files.append([name] + next(substreams))
+
+    def _readStreamsInfo_(self, b): #returns dictionary with pack positions, folders and substreams
+        streams = {'packPos' : 0, 'packSizes' : [], 'folders' : [], 'substreams' : []}
+        id = b.byte()
+        if id == 0x06: #kPackInfo
+            streams['packPos'] = 32 + b.number()
+            numPackStreams = b.number()
+            id = b.byte()
+            while id != 0x00:
+                if id == 0x09: #kSize
+                    streams['packSizes'] = [b.number() for i in range(numPackStreams)]
+                elif id == 0x0A: #kCRC
+                    b.digests(numPackStreams)
+                else:
+                    raise ValueError("Unexpected property {} in 7z pack info".format(id))
+                id = b.byte()
+            id = b.byte()
+        if id == 0x07: #kUnPackInfo
+            if b.byte() != 0x0B: #kFolder
+                raise ValueError("7z folder info not found")
+            numFolders = b.number()
+            if b.byte(): #external folders not supported
+                raise NotImplementedError("External folders in 7z archive not supported")
+            firstPackStream = 0
+            for i in range(numFolders):
+                folder = {'coders' : [], 'firstPackStream' : firstPackStream, 'crc' : None}
+                numOutStreams = 0
+                numInStreams = 0
+                for c in range(b.number()):
+                    flags = b.byte()
+                    codec = bytes(b.read(flags & 0x0F))
+                    if flags & 0x10: #complex coder
+                        nIn, nOut = b.number(), b.number()
+                    else:
+                        nIn, nOut = 1, 1
+                    properties = bytes(b.read(b.number())) if flags & 0x20 else b''
+                    folder['coders'].append([codec, properties])
+                    numInStreams += nIn
+                    numOutStreams += nOut
+                folder['bindPairs'] = [(b.number(), b.number()) for p in range(numOutStreams - 1)] #pairs of in index of coder bound to out index of other coder
+                numPacked = numInStreams - (numOutStreams - 1)
+                if numPacked > 1:
+                    for p in range(numPacked):
+                        b.number()
+                folder['numOutStreams'] = numOutStreams
+                firstPackStream += numPacked
+                streams['folders'].append(folder)
+            if b.byte() != 0x0C: #kCodersUnPackSize
+                raise ValueError("7z unpack sizes not found")
+            for folder in streams['folders']:
+                folder['sizes'] = [b.number() for o in range(folder['numOutStreams'])]
+                bound = [o for i, o in folder['bindPairs']]
+                folder['size'] = [size for o, size in enumerate(folder['sizes']) if o not in bound][0] #final output not bound to other coder
+            id = b.byte()
+            if id == 0x0A: #kCRC
+                for folder, crc in zip(streams['folders'], b.digests(numFolders)):
+                    folder['crc'] = crc
+                id = b.byte()
+            if id != 0x00:
+                raise ValueError("Unexpected property {} in 7z unpack info".format(id))
+            id = b.byte()
+        numUnpackStreams = [1] * len(streams['folders'])
+        if id == 0x08: #kSubStreamsInfo
+            id = b.byte()
+            if id == 0x0D: #kNumUnPackStream
+                numUnpackStreams = [b.number() for folder in streams['folders']]
+                id = b.byte()
+            sizes = []
+            for n, folder in zip(numUnpackStreams, streams['folders']):
+                if n == 0:
+                    continue
+                sizes.append([])
+                if id == 0x09: #kSize
+                    for j in range(n - 1):
+                        sizes[-1].append(b.number())
+                sizes[-1].append(folder['size'] - sum(sizes[-1]))
+            if id == 0x09:
+                id = b.byte()
+            unknownCRCs = sum(n for n, folder in zip(numUnpackStreams, streams['folders']) if not (n == 1 and folder['crc'] is not None))
+            crcs = [None] * unknownCRCs
+            if id == 0x0A: #kCRC
+                crcs = b.digests(unknownCRCs)
+                id = b.byte()
+            if id != 0x00:
+                raise ValueError("Unexpected property {} in 7z substreams info".format(id))
+            id = b.byte()
+            crcs = iter(crcs)
+            folderSizes = iter(sizes)
+            for i, (n, folder) in enumerate(zip(numUnpackStreams, streams['folders'])):
+                if n == 0:
+                    continue
+                offset = 0
+                for size in next(folderSizes):
+                    crc = folder['crc'] if n == 1 and folder['crc'] is not None else next(crcs)
+                    streams['substreams'].append([size, crc, i, offset])
+                    offset += size
+        else:
+            for i, folder in enumerate(streams['folders']):
+                streams['substreams'].append([folder['size'], folder['crc'], i, 0])
+        if id != 0x00:
+            raise ValueError("Unexpected property {} in 7z streams info".format(id))
+        return streams
+
+    def _unpackFolder_(self, streams, index, out, skip, size, crc, chunk = 1048576): #decompresses folder index in chunks and writes size bytes after skipping skip bytes to out
+        folder = streams['folders'][index]
+        if folder['numOutStreams'] != len(folder['coders']):
+            raise NotImplementedError("7z archive uses complex coders which are not supported")
+        bindings = dict(folder['bindPairs']) #for simple coders in and out index are the index of the coder
+        chain = [[o for o in range(len(folder['coders'])) if o not in bindings.values()][0]] #start with coder giving final output
+        while chain[-1] in bindings: #follow input of coder to output of next coder
+            chain.append(bindings[chain[-1]])
+        if len(chain) != len(folder['coders']):
+            raise NotImplementedError("7z archive uses complex coder chains which are not supported")
+        filters = [] #chain of lzma filters from final output to packed data, compressing filter being last
+        for codec, properties in [folder['coders'][c] for c in chain]:
+            if codec == b'\x21': #LZMA2
+                dictsize = 0xFFFFFFFF if properties[0] == 40 else (2 | (properties[0] & 1)) << (properties[0] // 2 + 11)
+                filters.append({'id' : lzma.FILTER_LZMA2, 'dict_size' : dictsize})
+            elif codec == b'\x03\x01\x01': #LZMA
+                d = properties[0]
+                dictsize = max(unpack('<I', properties[1:5])[0], 4096) #lzma module requires minimal dictionary size
+                filters.append({'id' : lzma.FILTER_LZMA1, 'lc' : d % 9, 'lp' : (d // 9) % 5, 'pb' : d // 45, 'dict_size' : dictsize})
+            elif codec == b'\x03' and len(properties) == 1: #Delta
+                filters.append({'id' : lzma.FILTER_DELTA, 'dist' : properties[0] + 1})
+            elif codec in _7ZBCJFILTERS:
+                filters.append({'id' : _7ZBCJFILTERS[codec]})
+            elif codec != b'\x00': #Copy needs no filter
+                raise NotImplementedError("7z coder {} not supported (e.g. encryption)".format(codec.hex()))
+        if filters:
+            decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters)
+        else:
+            decompressor = None
+        self._f_.seek(streams['packPos'] + sum(streams['packSizes'][:folder['firstPackStream']]))
+        packRemaining = streams['packSizes'][folder['firstPackStream']]
+        checksum = 0
+        while size > 0:
+            if decompressor is None or decompressor.needs_input:
+                data = self._f_.read(min(chunk, packRemaining))
+                packRemaining -= len(data)
+                if not data:
+                    raise ValueError("Unexpected end of packed data in 7z archive")
+            else:
+                data = b'' #decompressor has still output for the data given before
+            if decompressor is not None:
+                if decompressor.eof:
+                    raise ValueError("Unexpected end of compressed stream in 7z archive")
+                data = decompressor.decompress(data, max_length=chunk)
+            data = memoryview(data)
+            if skip:
+                cut = min(skip, len(data))
+                data = data[cut:]
+                skip -= cut
+            data = data[:size]
+            out.write(data)
+            checksum = crc32(data, checksum)
+            size -= len(data)
+        if crc is not None and checksum != crc:
+            raise ValueError("Data in 7z archive is corrupt (crc error)")
+
+    def getnames(self): #returns names of all files with data in archive
+        return [f[0] for f in self.files]
+
+    def extract(self, out, member = None): #writes member (default first dsf file or first file) decompressed to binary file out and returns its entry in files
+        if member is None:
+            names = [n for n in self.getnames() if n.lower().endswith(".dsf")] + self.getnames()
+            member = names[0] if names else None
+        for f in self.files:
+            if f[0] == member:
+                self._unpackFolder_(self._streams_, f[3], out, f[4], f[1], f[2])
+                return f
+        if member is None:
+            raise KeyError("No file with data found in 7z archive")
+        raise KeyError("File {} not found in 7z archive".format(member))
+
+
+def extract7z(f, member = None, out = None):
+    """
+    This function extracts member (default the first dsf file) of the 7z archive opened as binary file f
+    to the binary file out (default a new temporary file) using the lzma module of python.
+    It returns error code and a tuple (member name, length, crc, out) or error-string in case error != 0.
+    Error code -1 means that the archive uses features not supported (e.g. other coders than LZMA/LZMA2).
+    """
+    if not LZMAINSTALLED:
+        return -1, "ERROR in extract7z: Python module lzma not installed!"
+    try:
+        archive = DSF7zArchive(f)
+        if out is None:
+            out = TemporaryFile()
+            try:
+                name, size, crc = archive.extract(out, member)[:3]
+            except Exception:
+                out.close()
+                raise
+        else:
+            name, size, crc = archive.extract(out, member)[:3]
+    except NotImplementedError as e:
+        return -1, "ERROR in extract7z: {}".format(e)
+    except (ValueError, KeyError, IndexError, StopIteration, lzma.LZMAError) as e:
+        return -2, "ERROR in extract7z: {}".format(e)
+    out.seek(0)
+    return 0, (name, size, crc, out)